@@ -1,47 +1,167 @@
 ﻿# app.py
 import os
+import json
+import time
 import logging
-from flask import Flask, render_template, request, jsonify
-from markupsafe import Markup
-from web import AccessibilityAuditor  # Import the class from web.py
-from markdown import markdown # To render Gemini's markdown output nicely
+import threading
+import startup  # First, so the startup report's clock starts with the process
+with startup.timed("import_app_modules"):
+    from flask import Flask, Response, render_template, request, jsonify, url_for
+    from markupsafe import Markup
+    from web import AccessibilityAuditor  # Import the class from web.py
+    from jobs import JobQueue, JobStore, QueueFullError, DATA_EVENTS, TERMINAL_STATUSES
+    from audit_history import AuditHistory
+    from urlutils import normalize_url
+    import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
 app = Flask(__name__)
 
-# Initialize the Auditor
-# The API key is read from environment variables within the class constructor
-try:
-    auditor = AccessibilityAuditor()
-    logging.info("AccessibilityAuditor initialized successfully.")
-except ValueError as e:
-    # If API key is missing, the app can't function. Log critically.
-    logging.critical(f"Failed to initialize AccessibilityAuditor: {e}")
-    # In a real app, you might want to disable the audit functionality
-    # or display a persistent error message instead of letting it crash later.
-    auditor = None # Set auditor to None to indicate failure
-except Exception as e:
-    logging.critical(f"Unexpected error during Auditor initialization: {e}")
-    auditor = None
+# How much happens at import time:
+#   lazy     nothing heavy; the auditor (Gemini model, chromedriver, browsers) is built by the first audit
+#   eager    build the auditor and warm browsers at import
+#   preload  for `gunicorn --preload`: the master builds the auditor (imports, chromedriver, model) once;
+#            each forked worker then starts its own browsers, threads and database connections
+STARTUP_MODE = os.environ.get("A111Y_STARTUP", "lazy")
+
+# An events stream holds a worker thread, so it is closed after this long and the client reconnects
+SSE_MAX_SECONDS = float(os.environ.get("A111Y_SSE_MAX_SECONDS", 120))
+
+# A failed auditor init other than a missing API key (e.g. a chromedriver download) is retried after
+# this many seconds, doubling per consecutive failure up to the max
+AUDITOR_RETRY_BASE = float(os.environ.get("A111Y_AUDITOR_RETRY_BASE", 5))
+AUDITOR_RETRY_MAX = float(os.environ.get("A111Y_AUDITOR_RETRY_MAX", 300))
+
+
+def parse_int(value, default):
+    """A non-negative integer from a query string or header, `default` if absent, None if malformed."""
+    if value in (None, ""):
+        return default
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number >= 0 else None
+
+
+def markdown(text):
+    """To render Gemini's markdown output nicely; python-markdown is only imported once a report is rendered."""
+    from markdown import markdown as render
+    return render(text)
+
+
+# Past audit runs; trends are readable even when the auditor itself can't start
+audit_history = AuditHistory()
+
+# Audits run in the background; job state lives in SQLite so any worker can report on any job
+job_store = JobStore()
+job_store.purge_expired()
+
+auditor = None
+auditor_error = None
+auditor_retry_at = None  # time.monotonic() when a failed init is tried again; None if it won't be
+job_queue = None
+_auditor_lock = threading.Lock()
+_auditor_failures = 0
+
+
+def get_auditor(prewarm=True):
+    """The process's AccessibilityAuditor, built on first use. None if it can't be initialized."""
+    global auditor, auditor_error, auditor_retry_at, job_queue, _auditor_failures
+    with _auditor_lock:
+        retry_due = auditor_retry_at is not None and time.monotonic() >= auditor_retry_at
+        if auditor is None and (auditor_error is None or retry_due):
+            # The API key is read from environment variables within the class constructor
+            try:
+                with startup.timed("auditor_init"):
+                    auditor = AccessibilityAuditor(history=audit_history)
+                logging.info("AccessibilityAuditor initialized successfully.")
+                auditor_error = auditor_retry_at = None
+                _auditor_failures = 0
+            except ValueError as e:
+                # If API key is missing, the app can't function. Log critically.
+                logging.critical(f"Failed to initialize AccessibilityAuditor: {e}")
+                auditor_error = str(e)
+                auditor_retry_at = None
+            except Exception as e:
+                # Likely transient (network, chromedriver download): try again on a later request
+                _auditor_failures += 1
+                delay = min(AUDITOR_RETRY_MAX, AUDITOR_RETRY_BASE * 2 ** (_auditor_failures - 1))
+                logging.critical(f"Unexpected error during Auditor initialization: {e}. Retrying in {delay:.0f}s.")
+                auditor_error = str(e)
+                auditor_retry_at = time.monotonic() + delay
+            if auditor:
+                job_queue = JobQueue(job_store, auditor.analyze_page)
+                if prewarm:
+                    _start_prewarm()
+    return auditor
+
+
+def auditor_unavailable(message="Auditor service is not available."):
+    """Error response for a request that needs the auditor: 503 while a failed init awaits its retry, else 500."""
+    if auditor_retry_at is not None:
+        response = jsonify({"error": f"Auditor service failed to start ({auditor_error}). Please retry shortly."})
+        response.headers["Retry-After"] = str(max(1, int(auditor_retry_at - time.monotonic()) + 1))
+        return response, 503
+    return jsonify({"error": message}), 500
+
+
+def _start_prewarm():
+    # Start the pooled browsers in the background so the first audit doesn't pay Chrome's cold start
+    if os.environ.get("A111Y_POOL_PREWARM", "1") == "1":
+        threading.Thread(target=auditor.driver_pool.warm, name="driver-pool-warm", daemon=True).start()
+
+
+def _after_fork_in_worker():
+    """Give a forked worker its own browsers, threads and connections instead of the master's."""
+    global job_queue, _auditor_lock
+    startup.after_fork()
+    _auditor_lock = threading.Lock()
+    job_store.after_fork()
+    audit_history.after_fork()
+    if auditor:
+        auditor.after_fork()
+        job_queue = JobQueue(job_store, auditor.analyze_page)
+        _start_prewarm()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_worker)
+
+if STARTUP_MODE in ("eager", "preload"):
+    # A preloading master must not start browsers: they would be shared by every forked worker
+    get_auditor(prewarm=STARTUP_MODE == "eager")
 
 
 @app.route('/', methods=['GET'])
 def index():
     """Renders the homepage with the URL input form."""
     api_key_present = bool(os.environ.get("GEMINI_API_KEY")) # Check if key is set for UI feedback
-    auditor_initialized = bool(auditor)
+    # Don't build the auditor just to render the form; in lazy mode it is ready as long as it can be built
+    auditor_initialized = (auditor_error is None or auditor_retry_at is not None) and (auditor is not None or api_key_present)
     return render_template('index.html', api_key_present=api_key_present, auditor_initialized=auditor_initialized)
 
+def render_markdown(results):
+    """Convert Gemini markdown results to HTML for better display."""
+    if results.get("findings", {}).get("desktop", {}).get("gemini_analysis"):
+         results["findings"]["desktop"]["gemini_analysis_html"] = Markup(markdown(results["findings"]["desktop"]["gemini_analysis"]))
+    if results.get("findings", {}).get("mobile", {}).get("gemini_analysis"):
+         results["findings"]["mobile"]["gemini_analysis_html"] = Markup(markdown(results["findings"]["mobile"]["gemini_analysis"]))
+    if results.get("comprehensive_analysis"):
+         results["comprehensive_analysis_html"] = Markup(markdown(results["comprehensive_analysis"]))
+    return results
+
+
 @app.route('/audit', methods=['POST'])
 def audit():
-    """Handles the audit request, calls the auditor, and returns results."""
-    if not auditor:
+    """Queues an audit and immediately returns its job ID. Poll /audit/<id> or stream /audit/<id>/events."""
+    if not get_auditor():
          # If auditor failed to initialize (e.g., no API key), return an error
          logging.error("Audit request received but auditor is not initialized.")
          # Return JSON for potential JS handling on client-side, or render error template
-         return jsonify({"error": "Auditor service is not available. Check API key configuration."}), 500
+         return auditor_unavailable("Auditor service is not available. Check API key configuration.")
 
     url = request.form.get('url')
     if not url:
@@ -57,30 +177,186 @@ def audit():
 
     logging.info(f"Received audit request for URL: {url}")
 
+    # force=1 skips the cached Gemini analyses and re-runs every model call
+    force = (request.form.get('force') or request.args.get('force')) == '1'
+    # Stream Gemini output to /audit/<id>/events as it is generated (stream=0 to only get stage events)
+    stream = (request.form.get('stream') or request.args.get('stream') or '1') == '1'
+    # strict=1 loads every subresource (no analytics/media/font blocking), for fidelity checks
+    strict_network = (request.form.get('strict') or request.args.get('strict')) == '1'
+
     try:
-        # Run the analysis - This is the time-consuming part
-        results = auditor.analyze_page(url)
-        logging.info(f"Analysis complete for {url}. Errors: {results.get('errors', [])}")
+        job_id = job_queue.submit(url, force=force, stream=stream, strict_network=strict_network)
+    except QueueFullError as e:
+        # Backpressure: tell the client to come back instead of tying up a worker
+        logging.warning(f"Rejecting audit for {url}: {e}")
+        response = jsonify({"error": "The audit queue is full. Please retry shortly."})
+        response.headers["Retry-After"] = "30"
+        return response, 503
+
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": url_for('audit_status', job_id=job_id),
+        "events_url": url_for('audit_events', job_id=job_id),
+        "report_url": url_for('audit_report', job_id=job_id),
+    }), 202
 
-        # Convert Gemini markdown results to HTML for better display
-        if results.get("findings", {}).get("desktop", {}).get("gemini_analysis"):
-             results["findings"]["desktop"]["gemini_analysis_html"] = Markup(markdown(results["findings"]["desktop"]["gemini_analysis"]))
-        if results.get("findings", {}).get("mobile", {}).get("gemini_analysis"):
-             results["findings"]["mobile"]["gemini_analysis_html"] = Markup(markdown(results["findings"]["mobile"]["gemini_analysis"]))
-        if results.get("comprehensive_analysis"):
-             results["comprehensive_analysis_html"] = Markup(markdown(results["comprehensive_analysis"]))
 
+@app.route('/audit/<job_id>', methods=['GET'])
+def audit_status(job_id):
+    """Returns the job's status, current stage and, once finished, its results."""
+    job = job_store.get(job_id)
+    if not job:
+        return jsonify({"error": "Unknown audit job."}), 404
+    return jsonify(job)
 
-        # Render the results template
-        return render_template('results.html', results=results)
 
+@app.route('/audit/<job_id>/events', methods=['GET'])
+def audit_events(job_id):
+    """Server-sent events for a job until it ends.
+
+    - "stage": a pass entered a stage (loading, axe, screenshot, gemini, ...)
+    - "axe_results": a pass's Axe summary, as soon as Axe finishes
+    - "gemini_chunk": the next piece of a Gemini analysis as it streams in, with
+      "html" holding everything received so far for that analysis, rendered
+      from markdown (device is null for the comprehensive analysis)
+    """
+    if not job_store.get(job_id):
+        return jsonify({"error": "Unknown audit job."}), 404
+
+    # Resume where the client left off after a reconnect
+    last_event_id = parse_int(request.headers.get("Last-Event-ID") or request.args.get("after"), 0)
+    if last_event_id is None:
+        return jsonify({"error": "Last-Event-ID / after must be a non-negative integer."}), 400
+
+    def format_event(event, streamed_text):
+        payload = {"stage": event["stage"], "device": event["device"], "data": event["data"], "time": event["created_at"]}
+        if event["stage"] == "gemini_chunk":
+            # Re-render the accumulated markdown so the client can swap in the HTML as-is
+            key = event["device"] or "comprehensive"
+            streamed_text[key] = streamed_text.get(key, "") + event["data"]["text"]
+            payload["html"] = markdown(streamed_text[key])
+        name = event["stage"] if event["stage"] in DATA_EVENTS else "stage"
+        return f"id: {event['id']}\nevent: {name}\ndata: {json.dumps(payload)}\n\n"
+
+    def stream():
+        last_id = 0
+        streamed_text = {}  # analysis -> markdown received so far
+        last_write = started = time.monotonic()
+        while True:
+            job = job_store.get(job_id)
+            # Read from the start so a resumed stream still renders whole analyses, but only send what's new
+            for event in job_store.events_since(job_id, last_id):
+                last_id = event["id"]
+                message = format_event(event, streamed_text)
+                if last_id > last_event_id:
+                    yield message
+                    last_write = time.monotonic()
+
+            # Status was read before the events, so nothing written before the job ended is missed
+            if not job or job["status"] in TERMINAL_STATUSES:
+                yield f"event: end\ndata: {json.dumps({'status': job['status'] if job else 'unknown'})}\n\n"
+                return
+            if time.monotonic() - started > SSE_MAX_SECONDS:
+                # Give the worker thread back; EventSource reconnects with Last-Event-ID and picks up from here
+                yield "retry: 1000\n\n"
+                return
+            if time.monotonic() - last_write > 15:
+                yield ": keep-alive\n\n"  # Stop proxies from closing an idle stream
+                last_write = time.monotonic()
+            time.sleep(0.25)
+
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/audit/<job_id>/report', methods=['GET'])
+def audit_report(job_id):
+    """Renders the results page for a finished job."""
+    job = job_store.get(job_id)
+    if not job:
+        return jsonify({"error": "Unknown audit job."}), 404
+    if job["status"] == "failed":
+        return jsonify({"error": f"The audit failed: {job['error']}"}), 500
+    if job["status"] != "done":
+        return jsonify({"status": job["status"], "stage": job["stage"]}), 202
+
+    try:
+        results = job["result"]
+        logging.info(f"Rendering report for {results['url']}. Errors: {results.get('errors', [])}")
+        return render_template('results.html', results=render_markdown(results))
     except Exception as e:
-        # Catch unexpected errors during the audit call or template rendering
-        logging.error(f"Unexpected error during audit process for {url}: {e}", exc_info=True)
-        # Return JSON error or render a generic error template
+        # Catch unexpected errors during template rendering
+        logging.error(f"Unexpected error rendering report for job {job_id}: {e}", exc_info=True)
         return jsonify({"error": f"An unexpected server error occurred: {e}"}), 500
 
 
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters (for this worker) and size of the shared audit cache."""
+    if not get_auditor():
+        return auditor_unavailable()
+    return jsonify(auditor.cache.stats())
+
+
+@app.route('/gemini/stats', methods=['GET'])
+def gemini_stats():
+    """Gemini scheduler state for this worker: calls, retries, coalesced calls, queue wait and rate budget use."""
+    if not get_auditor():
+        return auditor_unavailable()
+    return jsonify(auditor.gemini.stats())
+
+
+@app.route('/history', methods=['GET'])
+def history_trends():
+    """Violation totals per past run of ?url= (optionally one ?device=), newest first. No browser is started."""
+    url = request.args.get('url')
+    if not url:
+        return jsonify({"error": "url is required."}), 400
+    if not url.startswith(('http://', 'https://')):
+        url = 'http://' + url
+    limit = parse_int(request.args.get('limit'), 50)
+    if limit is None:
+        return jsonify({"error": "limit must be a non-negative integer."}), 400
+    limit = min(limit, 500)
+    try:
+        url = normalize_url(url)
+    except ValueError:
+        return jsonify({"error": "url is malformed."}), 400
+    return jsonify({"url": url, "runs": audit_history.trends(url, device=request.args.get('device'), limit=limit)})
+
+
+@app.route('/history/rules/<rule_id>', methods=['GET'])
+def history_rule(rule_id):
+    """Node counts of one Axe rule per past run, for ?url= or every page where it has failed."""
+    url = request.args.get('url')
+    if url and not url.startswith(('http://', 'https://')):
+        url = 'http://' + url
+    limit = parse_int(request.args.get('limit'), 50)
+    if limit is None:
+        return jsonify({"error": "limit must be a non-negative integer."}), 400
+    limit = min(limit, 500)
+    try:
+        url = normalize_url(url) if url else None
+    except ValueError:
+        return jsonify({"error": "url is malformed."}), 400
+    return jsonify({"rule_id": rule_id, "url": url, "runs": audit_history.rule_trend(rule_id, url=url, limit=limit)})
+
+
+@app.route('/startup', methods=['GET'])
+def startup_report():
+    """How long this worker's imports and one-time initialization took, phase by phase."""
+    return jsonify(dict(startup.report(), auditor_initialized=auditor is not None, auditor_error=auditor_error,
+                           auditor_retry_in_s=round(max(0, auditor_retry_at - time.monotonic()), 1) if auditor_retry_at else None))
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint. Counters are per worker process."""
+    if job_queue:
+        metrics.JOBS_PENDING.set(job_queue.pending())
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 # Optional: Add basic error handlers for better UX
 @app.errorhandler(404)
 def page_not_found(e):
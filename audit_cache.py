@@ -0,0 +1,121 @@
+# audit_cache.py
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import tempfile
+import threading
+import logging
+
+from metrics import CACHE_LOOKUPS
+from sqlite_store import SqliteStore
+
+
+def content_fingerprint(html, axe_results):
+    """Hash of the rendered page and its Axe violations.
+
+    Two loads with the same fingerprint would give Gemini the same input, so
+    its earlier analysis can be reused.
+    """
+    digest = hashlib.sha256()
+    digest.update(html.encode("utf-8", "replace"))
+    violations = sorted(
+        (v["id"], v.get("impact") or "", sorted(str(n.get("target")) for n in v.get("nodes", [])))
+        for v in axe_results.get("violations", [])
+    )
+    digest.update(json.dumps(violations).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class AuditCache(SqliteStore):
+    """On-disk LRU cache of Gemini analyses with a TTL.
+
+    Entries live in SQLite so they survive restarts and are shared by every
+    worker on the host. Set A111Y_CACHE_TTL=0 to disable the cache.
+    """
+
+    def __init__(self, path=None, ttl=None, max_entries=None):
+        self.ttl = float(ttl if ttl is not None else os.environ.get("A111Y_CACHE_TTL", 24 * 3600))
+        self.max_entries = int(max_entries or os.environ.get("A111Y_CACHE_MAX_ENTRIES", 5000))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        path = path or os.environ.get("A111Y_CACHE_DB") or os.path.join(tempfile.gettempdir(), "a111y_cache.sqlite3")
+        super().__init__(path, """
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache (last_access);
+        """)
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def after_fork(self):
+        super().after_fork()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                row = conn.execute("SELECT value, created_at FROM cache WHERE key = ?", (key,)).fetchone()
+                if row and now - row["created_at"] <= self.ttl:
+                    conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+                elif row:
+                    conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    row = None
+        except sqlite3.Error as e:
+            # An unreadable cache is a miss, never a failed audit
+            logging.warning(f"Failed to read audit cache entry: {e}")
+            row = None
+        with self._lock:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        CACHE_LOOKUPS.inc(result="hit" if row else "miss")
+        return json.loads(row["value"]) if row else None
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now, now),
+                )
+                # Evict the least recently used entries beyond the size bound
+                conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        except sqlite3.Error as e:
+            # A cache write failure should never fail the audit itself
+            logging.warning(f"Failed to write audit cache entry: {e}")
+
+    def stats(self):
+        entries = self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+            }
@@ -0,0 +1,236 @@
+# audit_history.py
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import logging
+
+from sqlite_store import SqliteStore
+
+IMPACTS = ("critical", "serious", "moderate", "minor")
+
+
+def normalize_violations(violations):
+    """Axe violations reduced to what is worth keeping: rule, impact, help and the sorted node selectors."""
+    normalized = []
+    for v in violations:
+        nodes = sorted({" ".join(map(str, n.get("target") or [])) or n.get("html", "") for n in v.get("nodes", [])})
+        normalized.append({
+            "id": v["id"],
+            "impact": v.get("impact"),
+            "help": v.get("help"),
+            "help_url": v.get("helpUrl"),
+            "tags": v.get("tags", []),
+            "nodes": nodes,
+        })
+    return sorted(normalized, key=lambda v: v["id"])
+
+
+def diff_violations(previous, current):
+    """Compare two runs' normalized violations rule by rule.
+
+    Rules only in `current` are new, rules only in `previous` are fixed, and
+    rules in both are changed when their set of affected nodes differs and
+    unchanged otherwise. Rules are reported with node counts, not node lists.
+    """
+    before = {v["id"]: v for v in previous}
+    after = {v["id"]: v for v in current}
+    diff = {"new": [], "fixed": [], "changed": [], "unchanged": []}
+    for rule_id in sorted(before.keys() | after.keys()):
+        old, new = before.get(rule_id), after.get(rule_id)
+        if old is None:
+            diff["new"].append({"id": rule_id, "impact": new["impact"], "help": new["help"], "nodes": len(new["nodes"])})
+        elif new is None:
+            diff["fixed"].append({"id": rule_id, "impact": old["impact"], "help": old["help"], "nodes": len(old["nodes"])})
+        elif set(old["nodes"]) != set(new["nodes"]):
+            diff["changed"].append({
+                "id": rule_id,
+                "impact": new["impact"],
+                "help": new["help"],
+                "nodes_before": len(old["nodes"]),
+                "nodes_after": len(new["nodes"]),
+                "nodes_added": len(set(new["nodes"]) - set(old["nodes"])),
+                "nodes_removed": len(set(old["nodes"]) - set(new["nodes"])),
+            })
+        else:
+            diff["unchanged"].append({"id": rule_id, "impact": new["impact"], "nodes": len(new["nodes"])})
+    return diff
+
+
+def has_changes(diff):
+    return bool(diff["new"] or diff["fixed"] or diff["changed"])
+
+
+class AuditHistory(SqliteStore):
+    """Every audit pass's full, normalized Axe violations in a local SQLite file.
+
+    Runs are kept per normalized URL and device, so re-audits can be diffed
+    against the previous run and trends read back without a browser. The
+    newest `max_runs` runs per URL and device are kept.
+    """
+
+    def __init__(self, path=None, max_runs=None):
+        self.max_runs = int(max_runs or os.environ.get("A111Y_HISTORY_MAX_RUNS", 200))
+        path = path or os.environ.get("A111Y_HISTORY_DB") or os.path.join(tempfile.gettempdir(), "a111y_history.sqlite3")
+        super().__init__(path, """
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                device TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                fingerprint TEXT,
+                violations_count INTEGER NOT NULL,
+                nodes_count INTEGER NOT NULL,
+                impact_counts TEXT NOT NULL,
+                gemini_analysis TEXT,
+                analysis_mode TEXT,
+                network_mode TEXT
+            );
+            CREATE TABLE IF NOT EXISTS violations (
+                run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+                url TEXT NOT NULL,
+                device TEXT NOT NULL,
+                rule_id TEXT NOT NULL,
+                impact TEXT,
+                help TEXT,
+                help_url TEXT,
+                tags TEXT,
+                nodes TEXT NOT NULL,
+                node_count INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS comprehensive (
+                url TEXT NOT NULL,
+                analyses_key TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                analysis TEXT NOT NULL,
+                PRIMARY KEY (url, analyses_key)
+            );
+            CREATE INDEX IF NOT EXISTS idx_runs_url ON runs (url, device, created_at);
+            CREATE INDEX IF NOT EXISTS idx_violations_run ON violations (run_id);
+            CREATE INDEX IF NOT EXISTS idx_violations_url_rule ON violations (url, rule_id);
+            CREATE INDEX IF NOT EXISTS idx_violations_rule ON violations (rule_id);
+        """)
+        # Databases created before runs recorded how the page was loaded
+        self._add_missing_columns("runs", {"network_mode": "TEXT"})
+
+    def record(self, url, device, violations, fingerprint=None, gemini_analysis=None, analysis_mode=None,
+               network_mode="filter"):
+        """Store one pass's normalized violations. Returns the run id, or None if the write failed."""
+        impact_counts = {impact: 0 for impact in IMPACTS}
+        for v in violations:
+            if v["impact"] in impact_counts:
+                impact_counts[v["impact"]] += 1
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute(
+                    "INSERT INTO runs (url, device, created_at, fingerprint, violations_count, nodes_count, impact_counts,"
+                    " gemini_analysis, analysis_mode, network_mode) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (url, device, time.time(), fingerprint, len(violations), sum(len(v["nodes"]) for v in violations),
+                     json.dumps(impact_counts), gemini_analysis, analysis_mode, network_mode),
+                )
+                run_id = cursor.lastrowid
+                conn.executemany(
+                    "INSERT INTO violations (run_id, url, device, rule_id, impact, help, help_url, tags, nodes, node_count)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(run_id, url, device, v["id"], v["impact"], v["help"], v["help_url"], json.dumps(v["tags"]),
+                      json.dumps(v["nodes"]), len(v["nodes"])) for v in violations],
+                )
+                conn.execute(
+                    "DELETE FROM runs WHERE url = ? AND device = ? AND id NOT IN "
+                    "(SELECT id FROM runs WHERE url = ? AND device = ? ORDER BY created_at DESC LIMIT ?)",
+                    (url, device, url, device, self.max_runs),
+                )
+            return run_id
+        except sqlite3.Error as e:
+            # Losing a history entry should never fail the audit itself
+            logging.warning(f"Failed to record audit history for {url} ({device}): {e}")
+            return None
+
+    def record_comprehensive(self, url, analyses_key, analysis):
+        """Keep a comprehensive analysis for as long as the page's device analyses stay the same."""
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO comprehensive (url, analyses_key, created_at, analysis) VALUES (?, ?, ?, ?)",
+                    (url, analyses_key, time.time(), analysis),
+                )
+                # Only the latest one per page can match again once the device analyses move on
+                conn.execute("DELETE FROM comprehensive WHERE url = ? AND analyses_key != ?", (url, analyses_key))
+        except sqlite3.Error as e:
+            logging.warning(f"Failed to record comprehensive analysis for {url}: {e}")
+
+    def comprehensive_for(self, url, analyses_key):
+        try:
+            row = self._connect().execute(
+                "SELECT analysis FROM comprehensive WHERE url = ? AND analyses_key = ?", (url, analyses_key)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"Failed to read comprehensive analysis for {url}: {e}")
+            return None
+        return row["analysis"] if row else None
+
+    def last_run(self, url, device, network_mode="filter"):
+        """The most recent run for a URL, device and network mode with its normalized violations, or None."""
+        try:
+            conn = self._connect()
+            # Runs recorded before the mode was kept were filtered loads, the default
+            run = conn.execute(
+                "SELECT * FROM runs WHERE url = ? AND device = ? AND COALESCE(network_mode, 'filter') = ?"
+                " ORDER BY created_at DESC LIMIT 1", (url, device, network_mode)
+            ).fetchone()
+            if not run:
+                return None
+            rows = conn.execute("SELECT * FROM violations WHERE run_id = ? ORDER BY rule_id", (run["id"],)).fetchall()
+        except sqlite3.Error as e:
+            # Without history the pass just runs a full analysis
+            logging.warning(f"Failed to read audit history for {url} ({device}): {e}")
+            return None
+        result = self._run_dict(run)
+        result["gemini_analysis"] = run["gemini_analysis"]
+        result["violations"] = [
+            {"id": r["rule_id"], "impact": r["impact"], "help": r["help"], "help_url": r["help_url"],
+             "tags": json.loads(r["tags"] or "[]"), "nodes": json.loads(r["nodes"])}
+            for r in rows
+        ]
+        return result
+
+    def trends(self, url, device=None, limit=50):
+        """Per-run violation totals for a URL, newest first."""
+        query, params = "SELECT * FROM runs WHERE url = ?", [url]
+        if device:
+            query += " AND device = ?"
+            params.append(device)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        return [self._run_dict(run) for run in self._connect().execute(query, params)]
+
+    def rule_trend(self, rule_id, url=None, limit=50):
+        """Node counts of one Axe rule per run (0 where the rule passed), newest first; all URLs unless `url` is given."""
+        query = ("SELECT runs.id AS run_id, runs.url, runs.device, runs.created_at, COALESCE(v.node_count, 0) AS node_count "
+                 "FROM runs LEFT JOIN violations v ON v.run_id = runs.id AND v.rule_id = ?")
+        params = [rule_id]
+        if url:
+            query += " WHERE runs.url = ?"
+            params.append(url)
+        else:
+            # Only pages where the rule has failed at some point
+            query += " WHERE runs.url IN (SELECT DISTINCT url FROM violations WHERE rule_id = ?)"
+            params.append(rule_id)
+        query += " ORDER BY runs.created_at DESC LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self._connect().execute(query, params)]
+
+    @staticmethod
+    def _run_dict(run):
+        return {
+            "run_id": run["id"],
+            "url": run["url"],
+            "device": run["device"],
+            "created_at": run["created_at"],
+            "violations_count": run["violations_count"],
+            "nodes_count": run["nodes_count"],
+            "impact_counts": json.loads(run["impact_counts"]),
+            "analysis_mode": run["analysis_mode"],
+            "network_mode": run["network_mode"] or "filter",
+        }
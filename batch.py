@@ -0,0 +1,296 @@
+# batch.py
+"""Site-wide batch audits.
+
+Usage:
+    python batch.py --urls urls.txt --out audit.jsonl
+    python batch.py --sitemap https://example.com/sitemap.xml --concurrency 4 --out audit.jsonl
+    python batch.py --crawl https://example.com --depth 2 --max-pages 200 --out audit.jsonl
+
+Per-page results are appended to the JSONL file as each page finishes.
+Re-running the same command resumes an interrupted batch; a site-level
+roll-up of Axe violations is written next to it as <out>.rollup.json.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import xml.etree.ElementTree as ET
+from collections import deque
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from urlutils import normalize_url
+
+logging.basicConfig(level=logging.INFO)
+
+USER_AGENT = "a111y-batch/1.0 (+https://github.com/ahmadyoosuf/a111y)"
+SKIP_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png", ".gif", ".svg", ".webp", ".zip", ".mp4", ".mp3", ".css", ".js", ".xml")
+
+
+# --- URL discovery ------------------------------------------------------------
+
+def read_url_list(path):
+    """One URL per line; blank lines and #-comments are ignored."""
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+def read_sitemap(location, max_urls=None, _seen=None):
+    """URLs listed in a sitemap.xml (local path or URL), following sitemap indexes."""
+    _seen = _seen if _seen is not None else set()
+    if location in _seen:
+        return []
+    _seen.add(location)
+
+    if location.startswith(("http://", "https://")):
+        response = requests.get(location, timeout=30, headers={"User-Agent": USER_AGENT})
+        response.raise_for_status()
+        content = response.content
+    else:
+        with open(location, "rb") as f:
+            content = f.read()
+
+    root = ET.fromstring(content)
+    # Sitemaps are namespaced; match on the local tag name only
+    locs = [el.text.strip() for el in root.iter() if el.tag.rsplit("}", 1)[-1] == "loc" and el.text]
+    if root.tag.rsplit("}", 1)[-1] != "sitemapindex":
+        return locs[:max_urls] if max_urls else locs
+
+    urls = []
+    for child in locs:
+        urls.extend(read_sitemap(child, max_urls=max_urls, _seen=_seen))
+        if max_urls and len(urls) >= max_urls:
+            return urls[:max_urls]
+    return urls
+
+
+class _LinkExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.links.append(href)
+
+
+def crawl(seed, max_depth=1, max_pages=100, allowed_domains=None):
+    """Breadth-first crawl from `seed`, staying on the seed's host (plus `allowed_domains`)."""
+    allowed = {urlsplit(seed).hostname} | set(allowed_domains or [])
+    seen = {normalize_url(seed)}
+    found = []
+    queue = deque([(seed, 0)])
+    session = requests.Session()
+    session.headers["User-Agent"] = USER_AGENT
+
+    while queue and len(found) < max_pages:
+        url, depth = queue.popleft()
+        try:
+            response = session.get(url, timeout=20)
+        except requests.RequestException as e:
+            logging.warning(f"Crawl: failed to fetch {url}: {e}")
+            continue
+        if response.status_code >= 400 or "html" not in response.headers.get("Content-Type", ""):
+            continue
+        found.append(url)
+        if depth >= max_depth:
+            continue
+
+        parser = _LinkExtractor()
+        parser.feed(response.text)
+        for href in parser.links:
+            try:
+                link = urljoin(response.url, href)
+                parts = urlsplit(link)
+                if parts.scheme not in ("http", "https") or parts.hostname not in allowed:
+                    continue
+                if parts.path.lower().endswith(SKIP_EXTENSIONS):
+                    continue
+                key = normalize_url(link)
+            except ValueError as e:
+                # A malformed href (bad IPv6 literal, non-numeric port) shouldn't end the crawl
+                logging.warning(f"Crawl: skipping malformed link {href!r} on {url}: {e}")
+                continue
+            if key not in seen:
+                seen.add(key)
+                queue.append((key, depth + 1))
+    logging.info(f"Crawl from {seed} found {len(found)} pages")
+    return found
+
+
+def dedupe_urls(urls):
+    """Normalize and de-duplicate, keeping first-seen order."""
+    result = []
+    seen = set()
+    for url in urls:
+        if not url.startswith(("http://", "https://")):
+            url = "http://" + url
+        try:
+            key = normalize_url(url)
+        except ValueError as e:
+            logging.warning(f"Skipping malformed URL {url!r}: {e}")
+            continue
+        if key not in seen:
+            seen.add(key)
+            result.append(key)
+    return result
+
+
+# --- Running a batch ------------------------------------------------------------
+
+def page_failed(result):
+    """Whether a page's audit failed outright or on any device, so it is worth auditing again."""
+    if any(error.startswith("Audit failed:") for error in result.get("errors", [])):
+        return True
+    findings = result.get("findings") or {}
+    return not findings or any("error" in finding for finding in findings.values())
+
+
+def read_results(out_path):
+    """The last result per normalized URL in the results file; a resumed page's retry replaces its failure."""
+    results = {}
+    if not os.path.exists(out_path):
+        return results
+    with open(out_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+                results[normalize_url(result["url"])] = result
+            except (ValueError, KeyError):
+                continue  # A line cut short by an interruption; that page is re-audited
+    return results
+
+
+def load_completed(out_path):
+    """Normalized URLs the results file already has a successful audit for (the resume checkpoint).
+
+    Pages whose audit failed are left out, so a resumed batch retries them.
+    """
+    return {url for url, result in read_results(out_path).items() if not page_failed(result)}
+
+
+def _terminate_partial_line(path):
+    """Make sure new results don't get glued onto a line cut short by an interruption."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def run_batch(auditor, urls, out_path, concurrency=2, force=False, strict_network=False):
+    """Audit `urls` with `concurrency` pages in flight, appending each result to `out_path` as JSONL."""
+    done = load_completed(out_path)
+    _terminate_partial_line(out_path)
+    pending = [url for url in urls if url not in done]
+    logging.info(f"Batch: {len(urls)} URLs, {len(urls) - len(pending)} already done, {len(pending)} to audit")
+
+    started = time.monotonic()
+    with open(out_path, "a", encoding="utf-8") as out, \
+         ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+        futures = {executor.submit(auditor.analyze_page, url, force=force, strict_network=strict_network): url for url in pending}
+        for count, future in enumerate(as_completed(futures), 1):
+            url = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logging.error(f"Batch: audit of {url} failed: {e}", exc_info=True)
+                result = {"url": url, "findings": {}, "errors": [f"Audit failed: {e}"]}
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            logging.info(f"Batch: {count}/{len(pending)} done ({url}), {time.monotonic() - started:.0f}s elapsed")
+
+
+def build_rollup(out_path):
+    """Aggregate Axe violations by rule ID across every page in the results file. No model calls."""
+    rules = {}
+    pages = 0
+    failed_pages = 0
+    for result in read_results(out_path).values():
+        pages += 1
+        if result.get("errors"):
+            failed_pages += 1
+        for device, finding in result.get("findings", {}).items():
+            for v in finding.get("axe_violations", []):
+                rule = rules.setdefault(v["id"], {
+                    "id": v["id"], "impact": v["impact"], "help": v["help"],
+                    "pages": set(), "nodes": 0, "devices": {},
+                })
+                rule["pages"].add(result["url"])
+                rule["nodes"] += v["nodes"]
+                rule["devices"][device] = rule["devices"].get(device, 0) + v["nodes"]
+
+    impact_order = {"critical": 0, "serious": 1, "moderate": 2, "minor": 3}
+    summary = sorted(rules.values(), key=lambda r: (impact_order.get(r["impact"], 4), -len(r["pages"]), -r["nodes"]))
+    for rule in summary:
+        rule["pages_affected"] = len(rule.pop("pages"))
+    return {"pages": pages, "pages_with_errors": failed_pages, "rules": summary}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Audit many pages of a site and roll up the Axe violations.")
+    source = parser.add_argument_group("URL sources (any combination)")
+    source.add_argument("--urls", help="File with one URL per line")
+    source.add_argument("--sitemap", help="sitemap.xml URL or path")
+    source.add_argument("--crawl", metavar="SEED", help="Crawl links starting from this URL")
+    parser.add_argument("--depth", type=int, default=1, help="Crawl depth (default: 1)")
+    parser.add_argument("--max-pages", type=int, default=100, help="Maximum pages to audit (default: 100)")
+    parser.add_argument("--allow-domain", action="append", default=[], help="Extra host the crawl may follow (repeatable)")
+    parser.add_argument("--concurrency", type=int, default=2, help="Pages audited at the same time (default: 2)")
+    parser.add_argument("--out", required=True, help="JSONL file for per-page results")
+    parser.add_argument("--force", action="store_true", help="Ignore cached Gemini analyses")
+    parser.add_argument("--strict-network", action="store_true", help="Load every subresource instead of blocking analytics, media and fonts")
+    parser.add_argument("--restart", action="store_true", help="Discard earlier progress instead of resuming")
+    args = parser.parse_args(argv)
+
+    checkpoint_path = args.out + ".checkpoint.json"
+    if args.restart:
+        for path in (args.out, checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Reuse the URL list from an interrupted run so a resume doesn't re-crawl a changed site
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, encoding="utf-8") as f:
+            urls = json.load(f)["urls"]
+        logging.info(f"Resuming batch from {checkpoint_path}")
+    else:
+        urls = []
+        if args.urls:
+            urls += read_url_list(args.urls)
+        if args.sitemap:
+            urls += read_sitemap(args.sitemap, max_urls=args.max_pages)
+        if args.crawl:
+            urls += crawl(args.crawl, max_depth=args.depth, max_pages=args.max_pages, allowed_domains=args.allow_domain)
+        urls = dedupe_urls(urls)[:args.max_pages]
+        if not urls:
+            parser.error("No URLs to audit. Pass --urls, --sitemap or --crawl.")
+        with open(checkpoint_path, "w", encoding="utf-8") as f:
+            json.dump({"urls": urls, "created_at": time.strftime("%Y-%m-%d %H:%M:%S")}, f)
+
+    from web import AccessibilityAuditor
+    # One warm browser per concurrent page and device
+    auditor = AccessibilityAuditor(pool_size=args.concurrency)
+    try:
+        run_batch(auditor, urls, args.out, concurrency=args.concurrency, force=args.force, strict_network=args.strict_network)
+    finally:
+        auditor.driver_pool.shutdown()
+
+    rollup = build_rollup(args.out)
+    rollup_path = args.out + ".rollup.json"
+    with open(rollup_path, "w", encoding="utf-8") as f:
+        json.dump(rollup, f, indent=2)
+    logging.info(f"Batch complete: {rollup['pages']} pages, {len(rollup['rules'])} distinct rules. Roll-up: {rollup_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+# bench/fake_model.py
+import time
+import threading
+
+
+class FakeResponse:
+    """Looks enough like a google.generativeai GenerateContentResponse for AccessibilityAuditor."""
+
+    def __init__(self, text, chunks=None):
+        self.text = text
+        self.parts = [text] if text else []
+        self.prompt_feedback = None
+        self._chunks = chunks
+
+    def __iter__(self):
+        # Streaming responses yield chunk responses, each with its own .text
+        return iter(self._chunks or [self])
+
+    def resolve(self):
+        pass
+
+
+class FakeModel:
+    """Offline stand-in for genai.GenerativeModel.
+
+    Sleeps `latency` seconds per call (split across chunks when streaming)
+    and answers with a markdown report of roughly `response_chars`
+    characters. Calls and uploaded bytes are counted so benchmarks can check
+    what actually reached the "model".
+    """
+
+    def __init__(self, latency=1.0, response_chars=1500, stream_chunks=8):
+        self.latency = latency
+        self.response_chars = response_chars
+        self.stream_chunks = stream_chunks
+        self.calls = 0
+        self.bytes_in = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        parts = contents if isinstance(contents, list) else [contents]
+        size = 0
+        for part in parts:
+            if isinstance(part, dict):
+                size += len(part.get("data", b""))
+            elif isinstance(part, str):
+                size += len(part.encode("utf-8"))
+        with self._lock:
+            self.calls += 1
+            self.bytes_in += size
+            call = self.calls
+
+        text = self._report(call)
+        if not stream:
+            time.sleep(self.latency)
+            return FakeResponse(text)
+
+        step = max(1, len(text) // self.stream_chunks)
+        pieces = [text[i:i + step] for i in range(0, len(text), step)]
+        delay = self.latency / len(pieces)
+
+        def chunks():
+            for piece in pieces:
+                time.sleep(delay)
+                yield FakeResponse(piece)
+
+        return FakeResponse(text, chunks=chunks())
+
+    def _report(self, call):
+        lines = [f"The page has significant accessibility barriers (stub response #{call}).", ""]
+        n = 1
+        while sum(len(line) + 1 for line in lines) < self.response_chars:
+            lines.append(f"- **Barrier {n}:** Images lack text alternatives, so screen reader users miss content (WCAG 1.1.1, EN 9.1.1.1).")
+            n += 1
+        return "\n".join(lines)[:self.response_chars]
@@ -0,0 +1,317 @@
+# bench/run.py
+"""Offline benchmark suite for the audit pipeline.
+
+Serves the fixture corpus from a local HTTP server and swaps Gemini for
+bench.fake_model.FakeModel, so it needs no network and no API key. Only
+Chrome and a chromedriver are required; point CHROMEDRIVER_PATH at the
+driver, since webdriver-manager would try to download one.
+
+    CHROMEDRIVER_PATH=/usr/bin/chromedriver python -m bench.run --out bench.json
+    python -m bench.run --scenario latency --runs 10 --out after.json --compare before.json
+
+Scenarios:
+    latency     sequential audits per fixture; p50/p95 of total and per-stage time
+    throughput  N concurrent POST /audit requests through the Flask app's job queue
+    rss         peak resident memory of the worker process and its Chrome children
+Results are written as JSON, keyed so two runs (e.g. two commits) can be diffed.
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import logging
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+FIXTURES = ("static", "spa", "tall", "violations")
+
+
+# --- Fixture server ----------------------------------------------------------------
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    """Static fixtures plus a slow JSON endpoint the SPA fixture fetches from."""
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path == "/api/items":
+            query = parse_qs(parts.query)
+            time.sleep(int(query.get("delay", ["0"])[0]) / 1000)
+            count = int(query.get("count", ["1"])[0])
+            body = json.dumps([{"title": f"Item {i}", "body": f"Details for item {i}."} for i in range(count)]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable
+
+
+def start_fixture_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(FixtureHandler, directory=FIXTURES_DIR))
+    threading.Thread(target=server.serve_forever, name="fixture-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# --- Measurements --------------------------------------------------------------------
+
+def percentile(values, pct):
+    """Nearest-rank percentile; None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100 * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+def summarize(values):
+    return {
+        "n": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "min": min(values) if values else None,
+        "max": max(values) if values else None,
+    }
+
+
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _descendants(root_pid):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; ppid is the 2nd field after the closing paren
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    found, stack = [], [root_pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+class RssSampler:
+    """Samples resident memory of this process and of all its descendants (Chrome, chromedriver). Linux only."""
+
+    def __init__(self, interval=0.25):
+        self.interval = interval
+        self.peak_self_kb = 0
+        self.peak_total_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        pid = os.getpid()
+        while not self._stop.is_set():
+            own = _rss_kb(pid)
+            total = own + sum(_rss_kb(child) for child in _descendants(pid))
+            self.peak_self_kb = max(self.peak_self_kb, own)
+            self.peak_total_kb = max(self.peak_total_kb, total)
+            self._stop.wait(self.interval)
+
+
+# --- Scenarios -------------------------------------------------------------------------
+
+def scenario_latency(auditor, base_url, runs, fixtures):
+    """Sequential audits of each fixture; reports total and per-stage latency percentiles (ms)."""
+    report = {}
+    for fixture in fixtures:
+        url = f"{base_url}/{fixture}.html"
+        totals, stages, errors = [], {}, 0
+        for i in range(runs):
+            # force=True so every run pays the full pipeline instead of hitting the cache
+            results = auditor.analyze_page(url, force=True)
+            errors += len(results["errors"])
+            totals.append(results["timings"]["total"])
+            for device, finding in results["findings"].items():
+                for stage, ms in finding.get("timings", {}).items():
+                    stages.setdefault(f"{device}.{stage}", []).append(ms)
+            logging.info(f"latency[{fixture}] run {i + 1}/{runs}: {results['timings']['total']:.0f} ms")
+        report[fixture] = {
+            "total_ms": summarize(totals),
+            "stages_ms": {stage: summarize(values) for stage, values in sorted(stages.items())},
+            "errors": errors,
+        }
+    return report
+
+
+def scenario_throughput(auditor, base_url, concurrency, fixtures):
+    """Fire `concurrency` POST /audit requests at once and wait for every job to finish."""
+    import app as flask_app
+    from jobs import JobQueue
+
+    # Route the app's queue to the benchmark auditor (the module-level one needs a real API key)
+    flask_app.auditor = auditor
+    flask_app.job_queue = JobQueue(flask_app.job_store, auditor.analyze_page,
+                                   max_in_flight=concurrency, max_queued=concurrency)
+    client = flask_app.app.test_client()
+
+    urls = [f"{base_url}/{fixtures[i % len(fixtures)]}.html" for i in range(concurrency)]
+    started = time.monotonic()
+    job_ids, rejected = [], 0
+    for url in urls:
+        response = client.post("/audit", data={"url": url, "force": "1"})
+        if response.status_code == 202:
+            job_ids.append(response.get_json()["job_id"])
+        else:
+            rejected += 1
+
+    latencies, failed = [], 0
+    pending = set(job_ids)
+    while pending:
+        for job_id in list(pending):
+            job = client.get(f"/audit/{job_id}").get_json()
+            if job["status"] in ("done", "failed"):
+                pending.discard(job_id)
+                failed += job["status"] == "failed"
+                latencies.append((job["finished_at"] - job["created_at"]) * 1000)
+        time.sleep(0.2)
+    elapsed = time.monotonic() - started
+    flask_app.job_queue.shutdown(wait=True)
+
+    return {
+        "concurrency": concurrency,
+        "completed": len(job_ids) - failed,
+        "failed": failed,
+        "rejected": rejected,
+        "wall_s": round(elapsed, 2),
+        "audits_per_min": round(len(job_ids) / elapsed * 60, 2) if elapsed else None,
+        "job_latency_ms": summarize(latencies),
+    }
+
+
+# --- Driver --------------------------------------------------------------------------------
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline):
+    """Print p50/p95 deltas for every latency metric present in both result files."""
+    for fixture, data in current.get("scenarios", {}).get("latency", {}).items():
+        base = baseline.get("scenarios", {}).get("latency", {}).get(fixture)
+        if not base:
+            continue
+        for pct in ("p50", "p95"):
+            now, before = data["total_ms"][pct], base["total_ms"][pct]
+            if now is not None and before:
+                print(f"latency[{fixture}].total {pct}: {before:.0f} -> {now:.0f} ms ({(now - before) / before:+.1%})")
+    now, before = current.get("scenarios", {}).get("throughput"), baseline.get("scenarios", {}).get("throughput")
+    if now and before and before.get("audits_per_min"):
+        print(f"throughput: {before['audits_per_min']} -> {now['audits_per_min']} audits/min")
+    now, before = current.get("scenarios", {}).get("rss"), baseline.get("scenarios", {}).get("rss")
+    if now and before:
+        print(f"peak rss (worker + chrome): {before['peak_total_mb']} -> {now['peak_total_mb']} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the audit pipeline.")
+    parser.add_argument("--scenario", action="append", choices=("latency", "throughput", "rss"),
+                        help="Scenario to run (repeatable; default: all)")
+    parser.add_argument("--fixture", action="append", choices=FIXTURES, help="Fixture page (repeatable; default: all)")
+    parser.add_argument("--runs", type=int, default=5, help="Audits per fixture for the latency scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent /audit requests for the throughput scenario")
+    parser.add_argument("--model-latency", type=float, default=1.0, help="Seconds the fake model takes per call")
+    parser.add_argument("--response-chars", type=int, default=1500, help="Size of each fake model response")
+    parser.add_argument("--out", default="bench_results.json", help="Where to write machine-readable results")
+    parser.add_argument("--compare", help="Earlier results file to diff against")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    scenarios = args.scenario or ["latency", "throughput", "rss"]
+    fixtures = args.fixture or list(FIXTURES)
+
+    # Never reach the real Gemini API, and keep cache and job state away from a real deployment's files
+    os.environ.pop("GEMINI_API_KEY", None)
+    state_dir = tempfile.mkdtemp(prefix="a111y-bench-")
+    os.environ.setdefault("A111Y_CACHE_DB", os.path.join(state_dir, "cache.sqlite3"))
+    os.environ.setdefault("A111Y_JOB_DB", os.path.join(state_dir, "jobs.sqlite3"))
+    os.environ.setdefault("A111Y_HISTORY_DB", os.path.join(state_dir, "history.sqlite3"))
+
+    from web import AccessibilityAuditor
+    from bench.fake_model import FakeModel
+
+    model = FakeModel(latency=args.model_latency, response_chars=args.response_chars)
+    server, base_url = start_fixture_server()
+    auditor = AccessibilityAuditor(model=model, pool_size=max(1, args.concurrency))
+
+    output = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {
+            "runs": args.runs, "concurrency": args.concurrency, "fixtures": fixtures,
+            "model_latency_s": args.model_latency, "response_chars": args.response_chars,
+        },
+        "scenarios": {},
+    }
+    try:
+        auditor.driver_pool.warm()
+        with RssSampler() as sampler:
+            if "latency" in scenarios:
+                output["scenarios"]["latency"] = scenario_latency(auditor, base_url, args.runs, fixtures)
+            if "throughput" in scenarios:
+                output["scenarios"]["throughput"] = scenario_throughput(auditor, base_url, args.concurrency, fixtures)
+            if "rss" in scenarios and not ({"latency", "throughput"} & set(scenarios)):
+                # Nothing else ran, so drive one audit per fixture to have something to measure
+                for fixture in fixtures:
+                    auditor.analyze_page(f"{base_url}/{fixture}.html", force=True)
+        if "rss" in scenarios:
+            output["scenarios"]["rss"] = {
+                "peak_worker_mb": round(sampler.peak_self_kb / 1024, 1),
+                "peak_total_mb": round(sampler.peak_total_kb / 1024, 1),
+            }
+        output["model"] = {"calls": model.calls, "bytes_in": model.bytes_in}
+    finally:
+        auditor.driver_pool.shutdown()
+        server.shutdown()
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(output, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
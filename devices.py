@@ -0,0 +1,70 @@
+# devices.py
+"""Device profiles audited by AccessibilityAuditor, defined as data.
+
+Each profile gives the CSS viewport, device pixel ratio, whether the page
+should see a mobile/touch device, and the user agent (None keeps Chrome's
+own). Add an entry here to audit another device; nothing else needs to
+change.
+"""
+
+IPHONE_UA = ("Mozilla/5.0 (iPhone; CPU iPhone OS 11_0 like Mac OS X) AppleWebKit/604.1.38 "
+             "(KHTML, like Gecko) Version/11.0 Mobile/15A372 Safari/604.1")
+
+DEVICE_PROFILES = {
+    "desktop": {"width": 1280, "height": 800, "device_scale_factor": 1, "mobile": False, "touch": False, "user_agent": None},
+    # Same metrics and UA as Chrome's built-in "iPhone X" preset
+    "mobile": {"width": 375, "height": 812, "device_scale_factor": 3, "mobile": True, "touch": True, "user_agent": IPHONE_UA},
+}
+
+
+def chrome_mobile_emulation(profile):
+    """chromedriver's `mobileEmulation` option for a profile, or None for a plain desktop session."""
+    if not profile["mobile"]:
+        return None
+    emulation = {
+        "deviceMetrics": {
+            "width": profile["width"],
+            "height": profile["height"],
+            "pixelRatio": profile["device_scale_factor"],
+            "touch": profile["touch"],
+        },
+    }
+    if profile["user_agent"]:
+        emulation["userAgent"] = profile["user_agent"]
+    return emulation
+
+
+def apply_device_emulation(driver, profile, height=None):
+    """Switch a running session to `profile` through the DevTools protocol.
+
+    `height` overrides the profile's viewport height, e.g. to fit a taller
+    screenshot. The user agent falls back to the browser's own when the
+    profile doesn't set one, so switching back from mobile is clean.
+    """
+    driver.execute_cdp_cmd("Emulation.setDeviceMetricsOverride", {
+        "width": profile["width"],
+        "height": height or profile["height"],
+        "deviceScaleFactor": profile["device_scale_factor"],
+        "mobile": profile["mobile"],
+    })
+    driver.execute_cdp_cmd("Emulation.setTouchEmulationEnabled", {
+        "enabled": profile["touch"],
+        "maxTouchPoints": 5 if profile["touch"] else 1,
+    })
+    user_agent = profile["user_agent"] or _default_user_agent(driver)
+    driver.execute_cdp_cmd("Network.setUserAgentOverride", {"userAgent": user_agent})
+
+
+def clear_device_emulation(driver):
+    """Undo apply_device_emulation before the session goes back to the pool."""
+    driver.execute_cdp_cmd("Emulation.clearDeviceMetricsOverride", {})
+    driver.execute_cdp_cmd("Emulation.setTouchEmulationEnabled", {"enabled": False})
+    driver.execute_cdp_cmd("Network.setUserAgentOverride", {"userAgent": _default_user_agent(driver)})
+
+
+def _default_user_agent(driver):
+    ua = getattr(driver, "_a111y_default_ua", None)
+    if ua is None:
+        ua = driver.execute_cdp_cmd("Browser.getVersion", {})["userAgent"]
+        driver._a111y_default_ua = ua
+    return ua
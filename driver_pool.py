@@ -0,0 +1,259 @@
+# driver_pool.py
+import os
+import time
+import atexit
+import threading
+import logging
+from collections import deque
+from contextlib import contextmanager
+
+from selenium.common.exceptions import InvalidSessionIdException, TimeoutException, WebDriverException
+
+import startup
+from metrics import BROWSER_CRASHES, BROWSER_STARTS, stage_timer
+
+_chromedriver_path = None
+_chromedriver_lock = threading.Lock()
+
+
+def resolve_chromedriver_path():
+    """Resolve the chromedriver binary, once per process.
+
+    CHROMEDRIVER_PATH wins when set (useful for offline hosts and containers
+    that ship their own driver), otherwise webdriver-manager downloads or
+    locates a matching driver. The result is memoized, and survives a fork,
+    so a gunicorn --preload master resolves it for all of its workers.
+    """
+    global _chromedriver_path
+    with _chromedriver_lock:
+        if _chromedriver_path:
+            return _chromedriver_path
+        path = os.environ.get("CHROMEDRIVER_PATH")
+        if path:
+            logging.info(f"Using chromedriver from CHROMEDRIVER_PATH: {path}")
+        else:
+            with startup.timed("chromedriver_resolve"):
+                from webdriver_manager.chrome import ChromeDriverManager
+                path = ChromeDriverManager().install()
+            logging.info(f"Resolved chromedriver via webdriver-manager: {path}")
+        _chromedriver_path = path
+        return path
+
+
+class DriverPool:
+    """Keeps warm headless Chrome sessions per flavour ("desktop", "mobile").
+
+    Sessions are handed out with `session(flavour)`, reset between audits,
+    health-checked before reuse and recycled after `max_uses` audits or as
+    soon as they raise a WebDriverException.
+    """
+
+    def __init__(self, factory, flavours=("desktop", "mobile"), size=None, max_uses=None,
+                 acquire_timeout=None, window_size=(1280, 800), on_discard=None):
+        self.factory = factory  # callable(flavour) -> webdriver
+        self.on_discard = on_discard  # callable(driver), run once a session has quit
+        self.flavours = tuple(flavours)
+        self.size = int(size or os.environ.get("A111Y_POOL_SIZE", 2))
+        self.max_uses = int(max_uses or os.environ.get("A111Y_DRIVER_MAX_USES", 20))
+        self.acquire_timeout = float(acquire_timeout or os.environ.get("A111Y_POOL_ACQUIRE_TIMEOUT", 120))
+        self.window_size = window_size
+
+        self._cond = threading.Condition()
+        self._idle = {flavour: deque() for flavour in self.flavours}
+        self._live = {flavour: 0 for flavour in self.flavours}
+        self._uses = {}  # id(driver) -> number of audits served
+        self._closed = False
+
+    # --- Public API -------------------------------------------------------
+
+    @contextmanager
+    def session(self, flavour, timings=None):
+        """Borrow a driver for the duration of one audit pass.
+
+        Time spent waiting for (or starting) a browser is recorded as the
+        "acquire_driver" stage, into `timings` when given.
+        """
+        with stage_timer("acquire_driver", flavour, timings):
+            driver = self.acquire(flavour)
+        broken = False
+        try:
+            yield driver
+        except TimeoutException:
+            raise  # A slow page says nothing about the browser's health
+        except (InvalidSessionIdException, ConnectionError):
+            broken = True  # The browser or chromedriver is gone; never hand it out again
+            raise
+        except WebDriverException:
+            # Navigation errors (net::ERR_NAME_NOT_RESOLVED for a mistyped URL) leave the browser fine,
+            # so only recycle it if it no longer responds
+            broken = not self._is_healthy(driver)
+            raise
+        finally:
+            self.release(flavour, driver, broken=broken)
+
+    def acquire(self, flavour):
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            driver = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise WebDriverException("Driver pool is shut down.")
+                    if self._idle[flavour]:
+                        driver = self._idle[flavour].popleft()
+                        break
+                    if self._live[flavour] < self.size:
+                        self._live[flavour] += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise WebDriverException(f"Timed out waiting for a free {flavour} browser session.")
+                    self._cond.wait(remaining)
+
+            if driver is None:
+                return self._create(flavour)
+            if self._is_healthy(driver):
+                return driver
+            logging.warning(f"Discarding unhealthy {flavour} WebDriver session.")
+            BROWSER_CRASHES.inc(flavour=flavour)
+            self._discard(flavour, driver)
+
+    def release(self, flavour, driver, broken=False):
+        uses = self._uses.get(id(driver), 0) + 1
+        self._uses[id(driver)] = uses
+
+        if broken:
+            BROWSER_CRASHES.inc(flavour=flavour)
+        if broken or self._closed or uses >= self.max_uses:
+            reason = "crashed" if broken else ("pool closed" if self._closed else f"served {uses} audits")
+            logging.info(f"Recycling {flavour} WebDriver session ({reason}).")
+            self._discard(flavour, driver)
+            return
+
+        try:
+            self._reset(driver)
+        except Exception as e:
+            logging.warning(f"Failed to reset {flavour} WebDriver session, recycling it: {e}")
+            self._discard(flavour, driver)
+            return
+
+        with self._cond:
+            self._idle[flavour].append(driver)
+            self._cond.notify()
+
+    def warm(self):
+        """Start sessions until every flavour has `size` live drivers."""
+        for flavour in self.flavours:
+            while True:
+                with self._cond:
+                    if self._closed or self._live[flavour] >= self.size:
+                        break
+                    self._live[flavour] += 1
+                try:
+                    driver = self._create(flavour)
+                except WebDriverException as e:
+                    logging.error(f"Failed to warm {flavour} WebDriver session: {e}")
+                    break
+                with self._cond:
+                    self._idle[flavour].append(driver)
+                    self._cond.notify()
+        logging.info(f"Driver pool warm: {self.stats()}")
+
+    def shutdown(self):
+        """Quit every idle driver; drivers still in use are quit on release."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            idle = [(flavour, d) for flavour, drivers in self._idle.items() for d in drivers]
+            for drivers in self._idle.values():
+                drivers.clear()
+            self._cond.notify_all()
+        logging.info(f"Shutting down driver pool ({len(idle)} idle sessions).")
+        for flavour, driver in idle:
+            self._discard(flavour, driver)
+
+    def after_fork(self):
+        """Forget sessions inherited from the parent process; they are its browsers, not ours to reuse or quit."""
+        self._cond = threading.Condition()
+        self._idle = {flavour: deque() for flavour in self.flavours}
+        self._live = {flavour: 0 for flavour in self.flavours}
+        self._uses = {}
+        self._closed = False
+
+    def stats(self):
+        with self._cond:
+            return {
+                flavour: {"live": self._live[flavour], "idle": len(self._idle[flavour])}
+                for flavour in self.flavours
+            }
+
+    # --- Internals --------------------------------------------------------
+
+    def _create(self, flavour):
+        try:
+            driver = self.factory(flavour)
+        except Exception:
+            with self._cond:
+                self._live[flavour] -= 1
+                self._cond.notify()
+            raise
+        self._uses[id(driver)] = 0
+        BROWSER_STARTS.inc(flavour=flavour)
+        return driver
+
+    def _discard(self, flavour, driver):
+        self._uses.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception as e:
+            logging.warning(f"Error quitting {flavour} WebDriver session: {e}")
+        if self.on_discard:
+            self.on_discard(driver)
+        with self._cond:
+            self._live[flavour] -= 1
+            self._cond.notify()
+
+    def _is_healthy(self, driver):
+        try:
+            return driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def _reset(self, driver):
+        """Return a session to a blank state so audits don't leak into each other."""
+        # Close any windows/tabs the audited page opened
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(handles[0])
+
+        # Storage is per-origin, so clear it before leaving the audited page. Cache Storage goes too:
+        # a leftover service worker could answer the next audit of this origin from its own cache
+        clear_site_data(driver, "all")
+        driver.get("about:blank")
+        driver.set_window_size(*self.window_size)
+
+
+# Everything an origin keeps except its caches, for passes that should share only the HTTP cache
+SITE_DATA_TYPES = "cookies,local_storage,indexeddb,websql,file_systems,service_workers"
+
+
+def clear_site_data(driver, storage_types=SITE_DATA_TYPES):
+    """Drop the browser's cookies and the current page's origin storage (Storage.clearDataForOrigin types)."""
+    try:
+        origin = driver.execute_script("window.sessionStorage.clear(); return window.location.origin;")
+    except WebDriverException:
+        origin = None
+    if origin and origin != "null":  # Opaque origins (about:blank, data:) have no storage to clear
+        try:
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": storage_types})
+        except WebDriverException as e:
+            logging.warning(f"Failed to clear storage for {origin}: {e}")
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+
+
+def register_shutdown(pool):
+    """Quit pooled browsers when the Flask/gunicorn worker exits."""
+    atexit.register(pool.shutdown)
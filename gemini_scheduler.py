@@ -0,0 +1,250 @@
+# gemini_scheduler.py
+"""Coordinates every Gemini call an AccessibilityAuditor makes.
+
+- At most `max_concurrency` requests are upstream at once.
+- A rolling one-minute budget of requests (`rpm`) and estimated tokens
+  (`tpm`); callers wait for room instead of provoking 429s.
+- 429 and 5xx responses are retried with jittered exponential backoff. A
+  429 also pauses every other caller for the same delay, since the quota is
+  shared.
+- Identical prompts already in flight (the same page audited twice at
+  once) are coalesced into one upstream call. Followers get the leader's
+  streamed chunks as they arrive.
+
+The scheduler belongs to the auditor, so there is one per worker process.
+Set the limits per process accordingly.
+"""
+import os
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import deque
+
+from metrics import GEMINI_COALESCED, GEMINI_IN_FLIGHT, GEMINI_QUEUE_SECONDS, GEMINI_RETRIES
+
+# Gemini bills each image as a fixed number of tokens, regardless of size
+IMAGE_TOKENS = 258
+
+
+def estimate_tokens(contents):
+    """Rough input token count for budgeting: ~4 characters per token plus a flat cost per image."""
+    parts = contents if isinstance(contents, list) else [contents]
+    tokens = 0
+    for part in parts:
+        if isinstance(part, str):
+            tokens += len(part) // 4 + 1
+        elif isinstance(part, dict):
+            tokens += IMAGE_TOKENS
+    return tokens
+
+
+def prompt_key(contents):
+    """Stable hash of a prompt (text and image bytes), for coalescing identical calls."""
+    parts = contents if isinstance(contents, list) else [contents]
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            digest.update(b"text\0" + part.encode("utf-8") + b"\0")
+        elif isinstance(part, dict):
+            digest.update(f"{part.get('mime_type')}\0".encode() + part.get("data", b"") + b"\0")
+        else:
+            digest.update(repr(part).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def retry_reason(e):
+    """Why a failed call is worth retrying ("429", "503", "network"), or None if it isn't."""
+    # google.api_core errors carry the HTTP status as an int `code`
+    code = getattr(e, "code", None)
+    if isinstance(code, int) and (code == 429 or 500 <= code < 600):
+        return str(code)
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        return "network"
+    return None
+
+
+class _Flight:
+    """One upstream call that identical concurrent calls can wait on."""
+
+    def __init__(self, on_chunk):
+        self.streaming = on_chunk is not None
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+        self._lock = threading.Lock()
+        self._chunks = []
+        self._subscribers = [on_chunk] if on_chunk else []
+
+    def publish(self, text):
+        # Under the lock so a follower joining mid-stream sees every chunk exactly once, in order
+        with self._lock:
+            self._chunks.append(text)
+            for subscriber in self._subscribers:
+                subscriber(text)
+
+    def follow(self, on_chunk):
+        with self._lock:
+            if on_chunk and self.streaming:
+                for text in self._chunks:
+                    on_chunk(text)
+                self._subscribers.append(on_chunk)
+        self.done.wait()
+        if self.error:
+            raise self.error
+        if on_chunk and not self.streaming and self.response.parts:
+            on_chunk(self.response.text)  # The leader didn't stream, so hand over the text in one piece
+        return self.response
+
+
+class GeminiScheduler:
+    def __init__(self, model, max_concurrency=None, rpm=None, tpm=None, max_retries=None, base_delay=None, max_delay=None):
+        self.model = model
+        self.max_concurrency = int(max_concurrency or os.environ.get("A111Y_GEMINI_CONCURRENCY", 4))
+        # 0 disables a budget
+        self.rpm = int(rpm if rpm is not None else os.environ.get("A111Y_GEMINI_RPM", 60))
+        self.tpm = int(tpm if tpm is not None else os.environ.get("A111Y_GEMINI_TPM", 1_000_000))
+        self.max_retries = int(max_retries if max_retries is not None else os.environ.get("A111Y_GEMINI_MAX_RETRIES", 4))
+        self.base_delay = float(base_delay or os.environ.get("A111Y_GEMINI_BACKOFF_BASE", 1.0))
+        self.max_delay = float(max_delay or os.environ.get("A111Y_GEMINI_BACKOFF_MAX", 30.0))
+
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._cond = threading.Condition()
+        self._window = deque()  # [sent_at, tokens] for every request sent in the last minute
+        self._paused_until = 0.0
+        self._flights = {}  # prompt_key -> _Flight
+        self._flights_lock = threading.Lock()
+        self._stats = {"calls": 0, "upstream_requests": 0, "retries": 0, "coalesced": 0, "queue_wait_s": 0.0}
+
+    def generate(self, contents, on_chunk=None, call="device"):
+        """generate_content() under the scheduler's limits.
+
+        With `on_chunk`, the response is streamed and every text chunk is
+        passed to it as it arrives. Either way the returned response is
+        complete. `call` labels metrics ("device", "comprehensive").
+        """
+        key = prompt_key(contents)
+        with self._flights_lock:
+            self._stats["calls"] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(on_chunk)
+            else:
+                self._stats["coalesced"] += 1
+        if not leader:
+            logging.info(f"Coalescing {call} Gemini call with an identical request in flight")
+            GEMINI_COALESCED.inc(call=call)
+            return flight.follow(on_chunk)
+
+        try:
+            flight.response = self._call(contents, flight.publish if on_chunk else None, call)
+            return flight.response
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def after_fork(self):
+        """Fresh locks and no inherited in-flight calls in a forked worker. The rate budget starts over too."""
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._cond = threading.Condition()
+        self._window = deque()
+        self._paused_until = 0.0
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    def stats(self):
+        with self._cond:
+            self._prune(time.monotonic())
+            window = {"requests_last_minute": len(self._window), "tokens_last_minute": sum(t for _, t in self._window)}
+        with self._flights_lock:
+            stats = dict(self._stats, in_flight=len(self._flights))
+        stats["queue_wait_s"] = round(stats["queue_wait_s"], 3)
+        return dict(stats, **window, max_concurrency=self.max_concurrency, rpm=self.rpm, tpm=self.tpm)
+
+    # --- Internals --------------------------------------------------------
+
+    def _call(self, contents, on_chunk, call):
+        tokens = estimate_tokens(contents)
+        attempt = 0
+        while True:
+            queued_at = time.perf_counter()
+            with self._slots:
+                entry = self._reserve(tokens)
+                waited = time.perf_counter() - queued_at
+                GEMINI_QUEUE_SECONDS.observe(waited, call=call)
+                with self._flights_lock:
+                    self._stats["upstream_requests"] += 1
+                    self._stats["queue_wait_s"] += waited
+
+                streamed = []
+                try:
+                    with GEMINI_IN_FLIGHT.track():
+                        response = self._send(contents, on_chunk, streamed)
+                    self._record_usage(entry, response)
+                    return response
+                except Exception as e:
+                    error, reason = e, retry_reason(e)
+                    # Chunks already handed to the caller can't be taken back, so a broken stream isn't retried
+                    if reason is None or streamed or attempt >= self.max_retries:
+                        raise
+            # Full jitter: spread retries from concurrent callers instead of bunching them up
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            if reason == "429":
+                self._pause(delay)
+            attempt += 1
+            GEMINI_RETRIES.inc(call=call, reason=reason)
+            with self._flights_lock:
+                self._stats["retries"] += 1
+            logging.warning(f"Gemini {call} call failed ({reason}: {error}); retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+    def _send(self, contents, on_chunk, streamed):
+        if not on_chunk:
+            return self.model.generate_content(contents)
+        response = self.model.generate_content(contents, stream=True)
+        for chunk in response:
+            if chunk.parts:
+                streamed.append(chunk.text)
+                on_chunk(chunk.text)
+        return response
+
+    def _prune(self, now):
+        while self._window and now - self._window[0][0] >= 60:
+            self._window.popleft()
+
+    def _reserve(self, tokens):
+        """Block until the request fits the per-minute budgets and no 429 pause is active, then record it."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._prune(now)
+                wait = self._paused_until - now
+                if wait <= 0 and self.rpm and len(self._window) >= self.rpm:
+                    wait = self._window[0][0] + 60 - now
+                used = sum(t for _, t in self._window)
+                # A single prompt larger than the whole budget still goes out once the window is empty
+                if wait <= 0 and self.tpm and self._window and used + tokens > self.tpm:
+                    wait = self._window[0][0] + 60 - now
+                if wait <= 0:
+                    entry = [now, tokens]
+                    self._window.append(entry)
+                    return entry
+                self._cond.wait(wait)
+
+    def _record_usage(self, entry, response):
+        """Replace the estimate with the token count the API reports, when it reports one."""
+        usage = getattr(response, "usage_metadata", None)
+        total = getattr(usage, "total_token_count", None)
+        if isinstance(total, int) and total:
+            with self._cond:
+                entry[1] = total
+
+    def _pause(self, delay):
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
@@ -0,0 +1,16 @@
+# gunicorn.conf.py
+# Picked up automatically when gunicorn is started from the project root.
+#
+# Audits run on background threads and /audit/<id>/events holds a request open
+# while it streams progress, so workers must be threaded: a sync worker would be
+# tied up by one events stream and killed by --timeout along with its audits.
+import os
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("GUNICORN_WORKERS", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 16))
+# With gthread the timeout only covers a stuck worker, not a long request
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+# Time open requests get to finish when a worker is recycled or the server stops
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 120))
+preload_app = os.environ.get("A111Y_STARTUP") == "preload"
@@ -0,0 +1,71 @@
+# image_pipeline.py
+import os
+import math
+import time
+from io import BytesIO
+
+import startup
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+def encode_screenshot(png_bytes, viewport=None, max_pixels=None, image_format=None, quality=None, max_tiles=None):
+    """Turn a raw PNG screenshot into compact image parts for Gemini.
+
+    The PNG is decoded once, flattened to RGB, downscaled (keeping the aspect
+    ratio) to at most `max_pixels`, and encoded as JPEG/WebP. When `viewport`
+    (width, height) is given and the page is taller than one viewport, the
+    image is split into up to `max_tiles` viewport-shaped tiles, top to bottom.
+
+    Returns (parts, stats): parts are {"mime_type", "data"} dicts that
+    generate_content accepts directly; stats report sizes and encode time.
+    """
+    max_pixels = int(max_pixels or os.environ.get("A111Y_SCREENSHOT_MAX_PIXELS", 2_000_000))
+    image_format = (image_format or os.environ.get("A111Y_SCREENSHOT_FORMAT", "JPEG")).upper()
+    quality = int(quality or os.environ.get("A111Y_SCREENSHOT_QUALITY", 80))
+    max_tiles = int(max_tiles or os.environ.get("A111Y_SCREENSHOT_MAX_TILES", 4))
+    if image_format not in MIME_TYPES:
+        raise ValueError(f"Unsupported screenshot format: {image_format}")
+    with startup.timed("import_pil"):
+        from PIL import Image  # Imported here so processes that never encode a screenshot don't pay for it
+
+    start = time.perf_counter()
+    with Image.open(BytesIO(png_bytes)) as original:
+        original_size = original.size
+        # Screenshots carry an alpha channel JPEG can't store; this is the one decoded copy
+        img = original.convert("RGB")
+
+    width, height = img.size
+    if width * height > max_pixels:
+        scale = math.sqrt(max_pixels / (width * height))
+        img = img.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+        width, height = img.size
+
+    # Viewport-shaped tiles at the downscaled width, stretched if needed so max_tiles covers the page
+    tile_height = height
+    if viewport:
+        tile_height = max(1, round(width * viewport[1] / viewport[0]), math.ceil(height / max_tiles))
+    boxes = [(0, top, width, min(top + tile_height, height)) for top in range(0, height, tile_height)]
+
+    parts = []
+    for box in boxes:
+        tile = img if box == (0, 0, width, height) else img.crop(box)
+        buffer = BytesIO()
+        if image_format == "PNG":
+            tile.save(buffer, format="PNG", optimize=True)
+        else:
+            tile.save(buffer, format=image_format, quality=quality)
+        parts.append({"mime_type": MIME_TYPES[image_format], "data": buffer.getvalue()})
+    img.close()
+
+    stats = {
+        "format": image_format,
+        "quality": quality if image_format != "PNG" else None,
+        "original_size": list(original_size),
+        "sent_size": [width, height],
+        "tiles": len(parts),
+        "original_bytes": len(png_bytes),
+        "bytes_sent": sum(len(p["data"]) for p in parts),
+        "encode_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+    return parts, stats
@@ -0,0 +1,266 @@
+# jobs.py
+import os
+import json
+import time
+import uuid
+import tempfile
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlite_store import SqliteStore
+
+# Job lifecycle: queued -> running -> done | failed
+TERMINAL_STATUSES = ("done", "failed")
+# Events that carry partial results rather than marking a new stage
+DATA_EVENTS = ("axe_results", "gemini_chunk")
+
+
+class QueueFullError(Exception):
+    """Raised when the audit queue is at capacity; the client should retry later."""
+
+
+class JobStore(SqliteStore):
+    """Audit job state in a local SQLite file.
+
+    Every gunicorn worker on the host opens the same database, so any worker
+    can answer status and event requests for a job another worker is running.
+
+    Each unfinished job records the pid of the process that owns it and a
+    heartbeat that process's JobQueue keeps fresh. A job whose owner has
+    exited, or whose heartbeat is older than `stale_after` seconds, is marked
+    failed the next time it is read, so it can't stay "running" forever.
+    """
+
+    def __init__(self, path=None, retention=None, stale_after=None):
+        self.retention = float(retention or os.environ.get("A111Y_JOB_RETENTION", 24 * 3600))
+        self.stale_after = float(stale_after or os.environ.get("A111Y_JOB_STALE_AFTER", 60))
+        path = path or os.environ.get("A111Y_JOB_DB") or os.path.join(tempfile.gettempdir(), "a111y_jobs.sqlite3")
+        super().__init__(path, """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                result TEXT,
+                error TEXT,
+                owner_pid INTEGER,
+                updated_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS job_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                device TEXT,
+                created_at REAL NOT NULL,
+                data TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events (job_id, id);
+            CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at);
+        """)
+        # Databases created before jobs had owners and heartbeats
+        self._add_missing_columns("jobs", {"owner_pid": "INTEGER", "updated_at": "REAL"})
+
+    def create(self, url):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, url, status, created_at, owner_pid, updated_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, url, now, os.getpid(), now),
+            )
+        return job_id
+
+    def mark_running(self, job_id):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, owner_pid = ?, updated_at = ? WHERE id = ?",
+                (now, os.getpid(), now, job_id),
+            )
+
+    def heartbeat(self, job_ids):
+        """Tell readers these jobs' owner is still alive."""
+        if not job_ids:
+            return
+        with self._connect() as conn:
+            conn.executemany("UPDATE jobs SET updated_at = ? WHERE id = ?", [(time.time(), job_id) for job_id in job_ids])
+
+    def add_event(self, job_id, stage, device=None, data=None):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO job_events (job_id, stage, device, created_at, data) VALUES (?, ?, ?, ?, ?)",
+                (job_id, stage, device, time.time(), json.dumps(data) if data is not None else None),
+            )
+            if stage not in DATA_EVENTS:
+                conn.execute("UPDATE jobs SET stage = ? WHERE id = ?", (stage, job_id))
+
+    def finish(self, job_id, result):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', stage = 'done', finished_at = ?, result = ? WHERE id = ?",
+                (time.time(), json.dumps(result), job_id),
+            )
+
+    def fail(self, job_id, error):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE id = ?",
+                (time.time(), str(error), job_id),
+            )
+
+    def get(self, job_id):
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        if job["status"] not in TERMINAL_STATUSES and self._abandoned(job):
+            return self._fail_abandoned(job)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def _abandoned(self, job):
+        if job["updated_at"] is None or time.time() - job["updated_at"] > self.stale_after:
+            return True
+        return not _pid_alive(job["owner_pid"])
+
+    def _fail_abandoned(self, job):
+        error = "The worker running this audit exited before it finished. Please submit it again."
+        with self._connect() as conn:
+            # Only the first reader to notice marks it, and never a job that finished meanwhile
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), error, job["id"]),
+            )
+        if cursor.rowcount:
+            logging.warning(f"Audit job {job['id']} was abandoned by worker {job['owner_pid']}; marked failed")
+            self.add_event(job["id"], "failed", data={"error": error})
+        return self.get(job["id"])
+
+    def events_since(self, job_id, last_event_id=0):
+        rows = self._connect().execute(
+            "SELECT * FROM job_events WHERE job_id = ? AND id > ? ORDER BY id",
+            (job_id, last_event_id),
+        ).fetchall()
+        events = []
+        for row in rows:
+            event = dict(row)
+            event["data"] = json.loads(event["data"]) if event["data"] else None
+            events.append(event)
+        return events
+
+    def purge_expired(self):
+        """Drop jobs (and their events) older than the retention window."""
+        cutoff = time.time() - self.retention
+        with self._connect() as conn:
+            conn.execute("DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE created_at < ?)", (cutoff,))
+            conn.execute("DELETE FROM jobs WHERE created_at < ?", (cutoff,))
+
+
+def _pid_alive(pid):
+    """Whether a process with this pid exists on this host (the job database is host-local)."""
+    if not pid:
+        return True  # Unknown owner: rely on the heartbeat alone
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # Exists but belongs to someone else, or signals aren't supported (Windows)
+    return True
+
+
+class JobQueue:
+    """Runs audits on a bounded thread pool with a bounded backlog.
+
+    At most `max_in_flight` audits run at once in this process and at most
+    `max_queued` wait behind them; past that `submit` raises QueueFullError.
+    While any are pending, a background thread refreshes their heartbeat
+    every `heartbeat_interval` seconds (see JobStore). The same thread
+    purges expired jobs every `purge_interval` seconds.
+    """
+
+    def __init__(self, store, run_audit, max_in_flight=None, max_queued=None, heartbeat_interval=None,
+                 purge_interval=None):
+        self.store = store
+        self.run_audit = run_audit  # callable(url, progress=..., **options) -> results dict
+        self.max_in_flight = int(max_in_flight or os.environ.get("A111Y_MAX_IN_FLIGHT", 2))
+        self.max_queued = int(max_queued or os.environ.get("A111Y_MAX_QUEUED", 10))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="audit-job")
+        self._lock = threading.Lock()
+        self._pending = 0  # queued + running in this process
+        self._job_ids = set()  # Same jobs, by id, for the heartbeat
+        self.heartbeat_interval = float(heartbeat_interval or os.environ.get("A111Y_JOB_HEARTBEAT", 10))
+        self.purge_interval = float(purge_interval or os.environ.get("A111Y_JOB_PURGE_INTERVAL", 600))
+        self._heartbeat_thread = None
+        self._stopped = threading.Event()
+
+    def submit(self, url, **options):
+        with self._lock:
+            if self._pending >= self.max_in_flight + self.max_queued:
+                raise QueueFullError(f"Audit queue is full ({self._pending} jobs pending).")
+            self._pending += 1
+        job_id = None
+        try:
+            job_id = self.store.create(url)
+            with self._lock:
+                self._job_ids.add(job_id)
+                # Started on first use, so a gunicorn --preload master never owns the thread
+                if self._heartbeat_thread is None:
+                    self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="audit-job-heartbeat", daemon=True)
+                    self._heartbeat_thread.start()
+            self._executor.submit(self._run, job_id, url, options)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+                self._job_ids.discard(job_id)
+            raise
+        logging.info(f"Queued audit job {job_id} for {url}")
+        return job_id
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        self._stopped.set()
+
+    def _heartbeat(self):
+        last_purge = time.monotonic()
+        while not self._stopped.wait(self.heartbeat_interval):
+            with self._lock:
+                job_ids = list(self._job_ids)
+            try:
+                self.store.heartbeat(job_ids)
+            except Exception as e:
+                logging.warning(f"Failed to record job heartbeat: {e}")
+            # Retention would otherwise only apply at startup, and streamed chunks add an event row each
+            if time.monotonic() - last_purge >= self.purge_interval:
+                last_purge = time.monotonic()
+                try:
+                    self.store.purge_expired()
+                except Exception as e:
+                    logging.warning(f"Failed to purge expired jobs: {e}")
+
+    def _run(self, job_id, url, options):
+        try:
+            self.store.mark_running(job_id)
+            progress = lambda stage, device=None, data=None: self.store.add_event(job_id, stage, device, data)
+            result = self.run_audit(url, progress=progress, **options)
+            self.store.finish(job_id, result)
+            self.store.add_event(job_id, "done")
+            logging.info(f"Audit job {job_id} finished")
+        except Exception as e:
+            logging.error(f"Audit job {job_id} failed: {e}", exc_info=True)
+            self.store.fail(job_id, e)
+            self.store.add_event(job_id, "failed", data={"error": str(e)})
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._job_ids.discard(job_id)
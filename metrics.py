@@ -0,0 +1,170 @@
+# metrics.py
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Deliberately dependency-free and cheap: every update is a dict lookup and an
+addition under one lock. Each gunicorn worker keeps its own counters, so
+scrape every worker (or run one per container) to see the whole picture.
+"""
+import os
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_metrics = []
+
+# Seconds; wide enough for both a 50 ms Axe run and a 60 s page load
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        with _lock:
+            _metrics.append(self)
+
+    def _render_header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with _lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def render(self):
+        lines = self._render_header()
+        lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[_label_key(labels)] = value
+
+    @contextmanager
+    def track(self, **labels):
+        """Count something as in progress for the duration of the block."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self):
+        lines = self._render_header()
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+def _reset_lock():
+    # A thread holding the lock at fork time would otherwise leave it locked forever in the child
+    global _lock
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_lock)
+
+
+def render():
+    """All registered metrics as Prometheus text."""
+    with _lock:
+        lines = []
+        for metric in _metrics:
+            lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# --- Audit pipeline metrics --------------------------------------------------
+
+STAGE_SECONDS = Histogram("a111y_stage_duration_seconds", "Duration of each audit stage.")
+AUDITS_IN_FLIGHT = Gauge("a111y_audits_in_flight", "Audits currently running in this process.")
+AUDITS_TOTAL = Counter("a111y_audits_total", "Audits started.")
+GEMINI_ERRORS = Counter("a111y_gemini_errors_total", "Gemini calls that raised or returned an empty response.")
+GEMINI_BLOCKED = Counter("a111y_gemini_blocked_total", "Gemini calls blocked by safety settings.")
+GEMINI_QUEUE_SECONDS = Histogram("a111y_gemini_queue_wait_seconds", "Time Gemini calls waited for a concurrency slot and rate budget.",
+                                 buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+GEMINI_RETRIES = Counter("a111y_gemini_retries_total", "Gemini calls retried after a rate-limit, server or network error.")
+GEMINI_COALESCED = Counter("a111y_gemini_coalesced_total", "Gemini calls served by an identical call already in flight.")
+GEMINI_IN_FLIGHT = Gauge("a111y_gemini_requests_in_flight", "Gemini requests currently upstream.")
+BROWSER_CRASHES = Counter("a111y_browser_crashes_total", "Browser sessions discarded after a crash or failed health check.")
+BROWSER_STARTS = Counter("a111y_browser_starts_total", "Chrome sessions started.")
+CACHE_LOOKUPS = Counter("a111y_cache_lookups_total", "Audit cache lookups by result.")
+STARTUP_SECONDS = Gauge("a111y_startup_phase_seconds", "Time each import/initialization phase took in this process.")
+JOBS_PENDING = Gauge("a111y_jobs_pending", "Audit jobs queued or running in this process's job queue.")
+REQUESTS_BLOCKED = Counter("a111y_requests_blocked_total", "Page subresource requests blocked by the network filter.")
+PAGE_BYTES = Counter("a111y_page_bytes_total", "Bytes loaded by audited pages, by source (network or cache).")
+
+
+@contextmanager
+def stage_timer(stage, device=None, timings=None):
+    """Time a block as one audit stage.
+
+    The duration goes to STAGE_SECONDS, to a one-line key=value log record,
+    and, in milliseconds, into `timings[stage]` when a dict is passed. Failed
+    stages are recorded too, so a timeout still shows where the time went.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage, device=device or "all")
+        if timings is not None:
+            timings[stage] = round(elapsed * 1000, 1)
+        logging.info(f"stage={stage} device={device or 'all'} duration_ms={elapsed * 1000:.1f}")
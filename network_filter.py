@@ -0,0 +1,213 @@
+# network_filter.py
+"""Request blocking and the shared HTTP disk cache for audit browsers.
+
+Analytics beacons, ad scripts, video and web fonts rarely change what Axe
+reports or what the screenshot shows, but they dominate load time. Each
+capture blocks them through DevTools (`Network.setBlockedURLs`), and
+Chrome keeps its HTTP cache in a persistent directory so repeat audits of
+a site reuse its static assets.
+
+Blocking is set per page load, so a strict pass (nothing blocked, for
+fidelity checks) can run on the same pooled session as a filtered one.
+"""
+import os
+import json
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: disk cache slots are only exclusive within this process
+    fcntl = None
+
+# Chrome's blocklist matches whole URLs with "*" wildcards, so resource types are blocked by extension
+RESOURCE_TYPE_EXTENSIONS = {
+    "media": ("mp4", "webm", "ogv", "ogg", "mp3", "m4a", "m4v", "mov", "wav", "m3u8", "mpd"),
+    "font": ("woff", "woff2", "ttf", "otf", "eot"),
+    "image": ("png", "jpg", "jpeg", "gif", "webp", "avif", "svg", "ico"),
+}
+DEFAULT_BLOCKED_TYPES = ("media", "font")
+
+# Third-party analytics, tag managers, ads and session recorders
+DEFAULT_BLOCKED_HOSTS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+    "googleadservices.com", "adservice.google.com", "connect.facebook.net", "hotjar.com",
+    "clarity.ms", "segment.io", "cdn.segment.com", "mixpanel.com", "fullstory.com",
+    "scorecardresearch.com", "quantserve.com", "nr-data.net", "taboola.com", "outbrain.com",
+    "criteo.com", "amazon-adsystem.com", "ads-twitter.com", "snap.licdn.com",
+)
+
+
+def _env_list(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return tuple(default)
+    return tuple(item.strip().lower() for item in value.split(",") if item.strip())
+
+
+class NetworkPolicy:
+    """What audit browsers block and where they keep their HTTP cache.
+
+    `mode` is "filter" (block `blocked_types` and `blocked_hosts`) or
+    "strict" (block nothing). `cache_dir` is shared by all audit browsers on
+    the host; each running Chrome claims its own slot under it, since Chrome's
+    disk cache can't be shared by two browsers at once. An empty `cache_dir`
+    leaves Chrome's default throwaway profile cache in place.
+    """
+
+    def __init__(self, mode=None, blocked_types=None, blocked_hosts=None, cache_dir=None, cache_size_mb=None):
+        self.mode = mode or os.environ.get("A111Y_NETWORK_MODE", "filter")
+        if self.mode not in ("filter", "strict"):
+            raise ValueError(f"Unknown network mode: {self.mode}. Expected 'filter' or 'strict'.")
+        self.blocked_types = tuple(blocked_types if blocked_types is not None
+                                   else _env_list("A111Y_BLOCK_RESOURCE_TYPES", DEFAULT_BLOCKED_TYPES))
+        unknown = set(self.blocked_types) - set(RESOURCE_TYPE_EXTENSIONS)
+        if unknown:
+            raise ValueError(f"Unknown resource types: {sorted(unknown)}. Expected some of {sorted(RESOURCE_TYPE_EXTENSIONS)}.")
+        self.blocked_hosts = tuple(blocked_hosts if blocked_hosts is not None
+                                   else _env_list("A111Y_BLOCK_HOSTS", DEFAULT_BLOCKED_HOSTS))
+        self.cache_dir = cache_dir if cache_dir is not None else os.environ.get(
+            "A111Y_DISK_CACHE_DIR", os.path.join(tempfile.gettempdir(), "a111y_http_cache"))
+        self.cache_size = int(cache_size_mb or os.environ.get("A111Y_DISK_CACHE_MB", 256)) * 1024 * 1024
+
+        self._slots = {}  # cache dir -> open lock file held while a browser uses it
+        self._lock = threading.Lock()
+
+    def url_patterns(self, strict=False):
+        """Blocklist for Network.setBlockedURLs; empty in strict mode."""
+        if strict or self.mode == "strict":
+            return []
+        patterns = []
+        for resource_type in self.blocked_types:
+            for ext in RESOURCE_TYPE_EXTENSIONS[resource_type]:
+                patterns += [f"*.{ext}", f"*.{ext}?*"]
+        for host in self.blocked_hosts:
+            patterns += [f"*://{host}/*", f"*.{host}/*"]
+        return patterns
+
+    # --- Chrome sessions ------------------------------------------------------
+
+    def configure_options(self, options):
+        """Chrome options for a new session: network logging for byte counts, plus a disk cache slot.
+
+        Returns the claimed cache directory (None without one); hand it back
+        with release_cache_dir() once the browser has quit.
+        """
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+        options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": False})
+        if not self.cache_dir:
+            return None
+        cache_dir = self._claim_cache_dir()
+        options.add_argument(f"--disk-cache-dir={cache_dir}")
+        options.add_argument(f"--disk-cache-size={self.cache_size}")
+        return cache_dir
+
+    def after_fork(self):
+        """Drop the parent's cache-dir claims; its browsers keep their slots (the parent still holds the locks)."""
+        for handle in self._slots.values():
+            handle.close()
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def release_cache_dir(self, cache_dir):
+        with self._lock:
+            handle = self._slots.pop(cache_dir, None)
+        if handle:
+            handle.close()  # Closing the file drops the flock
+
+    def _claim_cache_dir(self):
+        """Lowest-numbered slot no other browser (in any worker process) is using."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._lock:
+            slot = 0
+            while True:
+                path = os.path.join(self.cache_dir, f"slot-{slot}")
+                if path not in self._slots:
+                    handle = open(path + ".lock", "w")
+                    try:
+                        if fcntl:
+                            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        handle.close()  # Held by another worker
+                    else:
+                        self._slots[path] = handle
+                        return path
+                slot += 1
+
+    def before_load(self, driver, strict=False):
+        """Apply the blocklist for the next page load and drop network events from earlier loads."""
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": self.url_patterns(strict)})
+        driver.get_log("performance")
+
+    def collect_stats(self, driver):
+        """Request, blocked and cached counts for everything loaded since before_load()."""
+        return network_stats(driver.get_log("performance"), self.blocked_hosts)
+
+
+def _host_matches(url, hosts):
+    host = url.split("://", 1)[-1].split("/", 1)[0].split(":", 1)[0].lower()
+    return any(host == h or host.endswith("." + h) for h in hosts)
+
+
+def network_stats(log_entries, blocked_hosts=()):
+    """Summarize chromedriver performance log entries for one page load.
+
+    Blocked requests never reach the network, so they are counted but have
+    no size. Cached bytes are the decoded size of responses served from
+    Chrome's disk or memory cache; network bytes are what came over the wire.
+    """
+    urls, cached = {}, set()
+    decoded = {}
+    stats = {
+        "requests": 0,
+        "blocked_requests": 0,
+        "blocked_by_host": 0,
+        "blocked_by_type": 0,
+        "cached_requests": 0,
+        "cached_bytes": 0,
+        "network_bytes": 0,
+    }
+    for entry in log_entries:
+        try:
+            message = json.loads(entry["message"])["message"]
+        except (KeyError, TypeError, ValueError):
+            continue
+        method, params = message.get("method"), message.get("params", {})
+        request_id = params.get("requestId")
+        if method == "Network.requestWillBeSent":
+            if request_id not in urls:
+                stats["requests"] += 1
+            urls[request_id] = params.get("request", {}).get("url", "")
+        elif method == "Network.requestServedFromCache":
+            cached.add(request_id)
+        elif method == "Network.responseReceived":
+            if params.get("response", {}).get("fromDiskCache"):
+                cached.add(request_id)
+        elif method == "Network.dataReceived":
+            decoded[request_id] = decoded.get(request_id, 0) + params.get("dataLength", 0)
+        elif method == "Network.loadingFinished":
+            if request_id in cached:
+                stats["cached_requests"] += 1
+                stats["cached_bytes"] += decoded.get(request_id, 0)
+            else:
+                stats["network_bytes"] += int(params.get("encodedDataLength", 0))
+        elif method == "Network.loadingFailed" and params.get("blockedReason"):
+            stats["blocked_requests"] += 1
+            if _host_matches(urls.get(request_id, ""), blocked_hosts):
+                stats["blocked_by_host"] += 1
+            else:
+                stats["blocked_by_type"] += 1
+    return stats
+
+
+def merge_network_stats(stats_list):
+    """Sum per-pass network stats into one dict for the whole audit."""
+    total = {}
+    for stats in stats_list:
+        for key, value in stats.items():
+            if isinstance(value, bool):
+                total[key] = total.get(key, False) or value
+            else:
+                total[key] = total.get(key, 0) + value
+    return total
@@ -0,0 +1,121 @@
+# readiness.py
+import os
+import time
+import logging
+
+from selenium.common.exceptions import WebDriverException
+
+# Installs the observers once per document. Registered to run before any page script
+# (install_readiness_probe), so requests fired while the page is still parsing are counted.
+INSTALL_SCRIPT = """
+(function () {
+    if (window.__a111yReady) { return; }
+    var s = window.__a111yReady = {inflight: 0, lastActivity: performance.now()};
+    var touch = function () { s.lastActivity = performance.now(); };
+
+    // DOM mutations and resizes count as layout activity
+    new MutationObserver(touch).observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+    window.addEventListener('resize', touch);
+
+    // Finished subresources and layout shifts
+    ['resource', 'layout-shift'].forEach(function (type) {
+        try { new PerformanceObserver(touch).observe({type: type, buffered: false}); } catch (e) {}
+    });
+
+    // Requests the page starts from script
+    if (window.fetch) {
+        var origFetch = window.fetch;
+        window.fetch = function () {
+            s.inflight++; touch();
+            var done = function () { s.inflight--; touch(); };
+            var p = origFetch.apply(this, arguments);
+            p.then(done, done);
+            return p;
+        };
+    }
+    var origSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        s.inflight++; touch();
+        this.addEventListener('loadend', function () { s.inflight--; touch(); });
+        return origSend.apply(this, arguments);
+    };
+})();
+"""
+
+# Reports the page's current state, installing the observers first if the page loaded without them
+PROBE_SCRIPT = INSTALL_SCRIPT + """
+var s = window.__a111yReady;
+return {readyState: document.readyState, inflight: s.inflight, quietMs: performance.now() - s.lastActivity};
+"""
+
+
+def install_readiness_probe(driver):
+    """Run the observers in every new document of this session before the page's own scripts.
+
+    Without this the probe is only installed after driver.get() returns, and a
+    client-rendered page's first data fetch is already in flight uncounted.
+    Registered once per session; the registration survives navigations.
+    """
+    if getattr(driver, "_a111y_probe_installed", False):
+        return
+    driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": INSTALL_SCRIPT})
+    driver._a111y_probe_installed = True
+
+
+# The signals that must all hold before a page counts as settled
+SIGNALS = ("ready_state", "network_idle", "dom_quiet")
+
+
+def wait_for_page_ready(driver, timeout=None, quiet_ms=None, poll_interval=0.1):
+    """Wait until the page has settled, or until `timeout` seconds have passed.
+
+    A page is settled once document.readyState is "complete", no fetch/XHR
+    requests are in flight, and neither the DOM, layout nor the resource list
+    has changed for `quiet_ms`. Returns a dict with the time spent waiting and
+    the signal that ended the wait: the last of SIGNALS to be satisfied, or
+    "timeout" when the ceiling was hit first.
+    """
+    timeout = float(timeout if timeout is not None else os.environ.get("A111Y_READY_TIMEOUT", 10))
+    quiet_ms = float(quiet_ms if quiet_ms is not None else os.environ.get("A111Y_READY_QUIET_MS", 500))
+
+    start = time.monotonic()
+    satisfied_since = {}  # signal -> when it became (and stayed) true
+    state = {}
+    while True:
+        now = time.monotonic()
+        try:
+            state = driver.execute_script(PROBE_SCRIPT) or {}
+        except WebDriverException as e:
+            # The document can be swapped out mid-probe (redirects, client-side navigation)
+            logging.debug(f"Readiness probe failed, retrying: {e}")
+            state = {}
+            satisfied_since.clear()
+
+        checks = {
+            "ready_state": state.get("readyState") == "complete",
+            "network_idle": state.get("inflight", 1) <= 0,
+            "dom_quiet": state.get("quietMs", 0) >= quiet_ms,
+        }
+        for signal, ok in checks.items():
+            if ok:
+                satisfied_since.setdefault(signal, now)
+            else:
+                satisfied_since.pop(signal, None)
+
+        elapsed = now - start
+        if all(checks.values()):
+            signal = max(SIGNALS, key=lambda name: satisfied_since[name])
+            return _report(elapsed, signal, state)
+        if elapsed >= timeout:
+            logging.info(f"Page not settled after {timeout}s; continuing. Last state: {state}")
+            return _report(elapsed, "timeout", state)
+        time.sleep(poll_interval)
+
+
+def _report(elapsed, signal, state):
+    return {
+        "waited_ms": round(elapsed * 1000),
+        "signal": signal,
+        "ready_state": state.get("readyState"),
+        "inflight_requests": state.get("inflight"),
+    }
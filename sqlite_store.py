@@ -0,0 +1,40 @@
+# sqlite_store.py
+import sqlite3
+import threading
+
+
+class SqliteStore:
+    """Base for the app's local SQLite files (jobs, audit cache, audit history).
+
+    Every gunicorn worker on the host opens the same file in WAL mode. sqlite3
+    connections can't be shared across threads, so each thread gets its own,
+    and a forked worker drops the ones it inherited.
+    """
+
+    def __init__(self, path, schema):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(schema)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def after_fork(self):
+        # A SQLite connection must not be used on both sides of a fork
+        self._local = threading.local()
+
+    def _add_missing_columns(self, table, columns):
+        """Bring a table from an older database up to date: {column: type} for columns added since."""
+        with self._connect() as conn:
+            existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for column, kind in columns.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
@@ -0,0 +1,56 @@
+# startup.py
+"""Cold start accounting: how long each import and initialization phase took in this process.
+
+Phases are recorded the first time they run, so wrapping a lazy import
+in `timed()` costs nothing on later calls. The report is served at
+/startup and exported as the a111y_startup_phase_seconds gauge. Use it to
+track cold start across releases.
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from metrics import STARTUP_SECONDS
+
+STARTED_AT = time.time()
+
+_lock = threading.Lock()
+_phases = {}  # phase -> {"ms": duration, "at_s": seconds after STARTED_AT it finished}
+
+
+@contextmanager
+def timed(phase):
+    """Record how long the block took, unless `phase` was already recorded in this process."""
+    if phase in _phases:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            if phase not in _phases:
+                _phases[phase] = {"ms": round(elapsed * 1000, 1), "at_s": round(time.time() - STARTED_AT, 3)}
+                STARTUP_SECONDS.set(elapsed, phase=phase)
+                logging.info(f"startup phase={phase} duration_ms={elapsed * 1000:.1f}")
+
+
+def report():
+    with _lock:
+        phases = dict(_phases)
+    return {
+        "pid": os.getpid(),
+        "mode": os.environ.get("A111Y_STARTUP", "lazy"),
+        "uptime_s": round(time.time() - STARTED_AT, 3),
+        "phases": phases,
+    }
+
+
+def after_fork():
+    """In a forked worker, keep the phases the parent recorded but restart the clock."""
+    global STARTED_AT, _lock
+    STARTED_AT = time.time()
+    _lock = threading.Lock()
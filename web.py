@@ -3,73 +3,212 @@ import os
 import json
 import time
 import base64
-from io import BytesIO
-from PIL import Image
-import google.generativeai as genai
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+import threading
+from concurrent.futures import ThreadPoolExecutor
+# Selenium's webdriver, axe_selenium_python and google.generativeai are imported on first use, keeping cold start cheap
 from selenium.common.exceptions import TimeoutException, WebDriverException
-from webdriver_manager.chrome import ChromeDriverManager
-from axe_selenium_python import Axe
+import startup
+from driver_pool import DriverPool, clear_site_data, register_shutdown, resolve_chromedriver_path
+from readiness import install_readiness_probe, wait_for_page_ready
+from audit_cache import AuditCache, content_fingerprint
+from urlutils import normalize_url
+from image_pipeline import encode_screenshot
+from metrics import AUDITS_IN_FLIGHT, AUDITS_TOTAL, GEMINI_BLOCKED, GEMINI_ERRORS, PAGE_BYTES, REQUESTS_BLOCKED, stage_timer
+from network_filter import NetworkPolicy, merge_network_stats
+from gemini_scheduler import GeminiScheduler
+from audit_history import AuditHistory, diff_violations, has_changes, normalize_violations
+from devices import DEVICE_PROFILES, apply_device_emulation, chrome_mobile_emulation, clear_device_emulation
 
 # Configure logging for better debugging on Vercel
 import logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(threadName)s %(message)s")
+
+# How device passes get a browser:
+#   parallel        one pooled session per device (mobile via chromedriver's mobileEmulation), passes run side by side
+#   single-session  one session per audit, switching device profiles through DevTools emulation so later
+#                   loads hit the warm HTTP cache; browser work is sequential, Gemini calls still overlap
+AUDIT_MODES = ("parallel", "single-session")
+# Pool flavour used by single-session audits: plain desktop Chrome, emulation applied per pass
+SHARED_SESSION = "shared"
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def load_model(api_key, name="gemini-1.5-flash"):
+    """The Gemini model for an API key, configured once per process."""
+    with _models_lock:
+        if (api_key, name) not in _models:
+            with startup.timed("import_genai"):
+                import google.generativeai as genai
+            with startup.timed("model_init"):
+                genai.configure(api_key=api_key)
+                _models[(api_key, name)] = genai.GenerativeModel(name)
+        return _models[(api_key, name)]
+
+
+def summarize_violations(violations):
+    """Compact form of Axe violations: rule id, impact, help text and node count."""
+    return [
+        {
+            "id": v['id'],
+            "impact": v['impact'],
+            "help": v['help'],
+            "nodes": len(v['nodes'])
+        } for v in violations
+    ]
 
 
 class AccessibilityAuditor:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, pool_size=None, driver_max_uses=None, devices=None, device_concurrency=None,
+                 ready_timeout=None, ready_quiet_ms=None, cache=None, model=None, audit_mode=None, network=None,
+                 scheduler=None, history=None, incremental=None):
         self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
-        if not self.api_key:
-            logging.error("GEMINI_API_KEY not found in environment variables.")
-            raise ValueError("GEMINI_API_KEY not set.")
-
-        try:
-            genai.configure(api_key=self.api_key)
-            # Using a stable, generally available model recommended for production
-            self.model = genai.GenerativeModel("gemini-1.5-flash")
-            logging.info("Gemini Model initialized.")
-        except Exception as e:
-            logging.error(f"Failed to configure Gemini: {e}")
-            raise
+        if model is not None:
+            # Any object with genai.GenerativeModel's generate_content(), e.g. the offline benchmark stub
+            self.model = model
+            logging.info(f"Using injected model: {type(model).__name__}")
+        else:
+            if not self.api_key:
+                logging.error("GEMINI_API_KEY not found in environment variables.")
+                raise ValueError("GEMINI_API_KEY not set.")
 
-    def setup_driver(self, mobile=False):
-        """Set up webdriver using webdriver-manager for local execution"""
-        logging.info(f"Setting up WebDriver (Mobile: {mobile}) using webdriver-manager")
+            try:
+                # Using a stable, generally available model recommended for production
+                self.model = load_model(self.api_key, "gemini-1.5-flash")
+                logging.info("Gemini Model initialized.")
+            except Exception as e:
+                logging.error(f"Failed to configure Gemini: {e}")
+                raise
+
+        # Every model call goes through one scheduler: concurrency cap, rate budget, retries, coalescing
+        self.gemini = scheduler or GeminiScheduler(self.model)
+
+        # Device passes run per audit (keys of DEVICE_PROFILES), and how many of them may run at the same time
+        self.devices = tuple(devices or DEVICE_PROFILES.keys())
+        self.device_concurrency = int(device_concurrency or os.environ.get("A111Y_DEVICE_CONCURRENCY", len(self.devices)))
+
+        self.audit_mode = audit_mode or os.environ.get("A111Y_AUDIT_MODE", "parallel")
+        if self.audit_mode not in AUDIT_MODES:
+            raise ValueError(f"Unknown audit mode: {self.audit_mode}. Expected one of {AUDIT_MODES}.")
+
+        # Ceiling and quiet window for page readiness (see readiness.wait_for_page_ready)
+        self.ready_timeout = ready_timeout
+        self.ready_quiet_ms = ready_quiet_ms
+
+        # Gemini analyses keyed on URL, device and rendered content
+        self.cache = cache or AuditCache()
+
+        # Full Axe violations of every pass; re-audits only ask Gemini about what changed since the last run
+        self.history = history or AuditHistory()
+        self.incremental = incremental if incremental is not None else os.environ.get("A111Y_INCREMENTAL", "1") == "1"
+
+        # Which subresources page loads skip, and the HTTP disk cache shared by all audit browsers
+        self.network = network or NetworkPolicy()
+
+        # Resolve chromedriver once per process instead of on every setup_driver call
+        self.chromedriver_path = resolve_chromedriver_path()
+        self.driver_pool = DriverPool(
+            factory=lambda flavour: self.setup_driver(profile=DEVICE_PROFILES.get(flavour, DEVICE_PROFILES["desktop"])),
+            flavours=(SHARED_SESSION,) if self.audit_mode == "single-session" else self.devices,
+            size=pool_size,
+            max_uses=driver_max_uses,
+            on_discard=lambda driver: self.network.release_cache_dir(getattr(driver, "_a111y_cache_dir", None)),
+        )
+        register_shutdown(self.driver_pool)
+
+    def after_fork(self):
+        """Make a copy inherited by a forked worker (gunicorn --preload) safe to use.
+
+        The parent's browsers, database connections, locks and cache-dir
+        claims stay with the parent; the worker starts its own.
+        """
+        self.driver_pool.after_fork()
+        self.network.after_fork()
+        self.gemini.after_fork()
+        self.cache.after_fork()
+        self.history.after_fork()
+
+    def setup_driver(self, mobile=False, profile=None):
+        """Start a new headless Chrome session for a device profile. Audits borrow sessions from self.driver_pool instead."""
+        if profile is None:
+            profile = DEVICE_PROFILES["mobile" if mobile else "desktop"]
+        logging.info(f"Setting up WebDriver (Mobile: {profile['mobile']})")
+        with startup.timed("import_selenium"):
+            from selenium import webdriver
+            from selenium.webdriver.chrome.service import Service
+            from selenium.webdriver.chrome.options import Options
         options = Options()
         # Keep essential options for headless execution
         options.add_argument("--headless")
         options.add_argument("--disable-gpu")
         options.add_argument("--no-sandbox")
-        options.add_argument("--window-size=1280x800") # Standard size
+        options.add_argument(f"--window-size={profile['width']},{profile['height']}")
         # Add user agent if needed, but often not required locally
         # options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.88 Safari/537.36")
 
-        if mobile:
-            mobile_emulation = {"deviceName": "iPhone X"}
-            options.add_experimental_option("mobileEmulation", mobile_emulation)
-            logging.info("Mobile emulation enabled for iPhone X.")
+        emulation = chrome_mobile_emulation(profile)
+        if emulation:
+            options.add_experimental_option("mobileEmulation", emulation)
+            logging.info(f"Mobile emulation enabled: {emulation}")
+
+        # Network logging for per-audit byte counts, and this browser's slot in the shared disk cache
+        cache_dir = self.network.configure_options(options)
 
         try:
-            # Let webdriver-manager handle the driver download and path automatically
-            # It will find your installed Chrome. Make sure Chrome is installed!
-            service = Service(ChromeDriverManager().install())
+            # chromedriver_path was resolved once in __init__ (CHROMEDRIVER_PATH or webdriver-manager)
+            service = Service(self.chromedriver_path)
             driver = webdriver.Chrome(service=service, options=options)
-            logging.info("WebDriver created successfully via webdriver-manager.")
+            driver._a111y_cache_dir = cache_dir
+            logging.info("WebDriver created successfully.")
             return driver
         except Exception as e:
+             self.network.release_cache_dir(cache_dir)
              # Catch any exception during driver setup
-             logging.error(f"WebDriver setup via webdriver-manager failed: {e}", exc_info=True)
+             logging.error(f"WebDriver setup failed: {e}", exc_info=True)
              # Re-raise a specific error to be caught by analyze_page
-             raise WebDriverException(f"Failed to set up Chrome Driver using webdriver-manager: {e}")
+             raise WebDriverException(f"Failed to set up Chrome Driver: {e}")
+
+
+    def analyze_page(self, url, wait_time=15, devices=None, progress=None, force=False, stream=False,
+                     strict_network=False): # Increased wait time slightly
+        """Full analysis of a page, including direct Gemini analysis.
+
+        Gemini analyses are reused from self.cache when the rendered content is
+        unchanged; `force=True` skips the lookup (fresh results are still cached).
+
+        `progress`, if given, is called as progress(stage, device, data) when a
+        pass enters a stage (loading, axe, screenshot, gemini, comprehensive).
+        Axe summaries are pushed as an "axe_results" event as soon as Axe
+        finishes. With `stream=True`, Gemini output is also pushed as it is
+        generated, as "gemini_chunk" events ({"text": ...}; device is None for
+        the comprehensive analysis). The returned results are the same either way.
 
+        Per-stage durations (ms) are reported under each finding's "timings"
+        and, for the whole audit, under results["timings"].
 
-    def analyze_page(self, url, wait_time=15): # Increased wait time slightly
-        """Full analysis of a page, including direct Gemini analysis"""
+        Every pass's full Axe violations are recorded in self.history. When
+        the previous run of the page has an analysis, Gemini is only asked
+        about the violations that changed since (or not at all if none did);
+        each finding's "violations_diff" lists new, fixed, changed and
+        unchanged rules. `force=True` always runs a full analysis.
+
+        Page loads skip what self.network blocks (analytics, ads, media, fonts
+        by default); `strict_network=True` loads everything, for fidelity
+        checks. Request, blocked and cached counts are reported under each
+        finding's "network" and, summed, under results["network"]. Strict and
+        filtered passes never reuse each other's cached or previous analyses.
+        """
+        AUDITS_TOTAL.inc()
+        with AUDITS_IN_FLIGHT.track():
+            timings = {}
+            with stage_timer("total", timings=timings):
+                results = self._analyze_page(url, wait_time, devices, progress, force, stream, strict_network, timings)
+            results["timings"] = timings
+            return results
+
+    def _analyze_page(self, url, wait_time, devices, progress, force, stream, strict_network, timings):
         logging.info(f"Starting analysis for URL: {url}")
         results = {"url": url, "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "findings": {}, "errors": []}
 
@@ -80,115 +219,372 @@ class AccessibilityAuditor:
             return results
 
 
-        for device in ["desktop", "mobile"]:
-            driver = None # Ensure driver is None initially for finally block
-            logging.info(f"Analyzing {device} version of {url}")
-            try:
-                driver = self.setup_driver(mobile=(device == "mobile"))
+        devices = list(devices or self.devices)
+        if self.audit_mode == "single-session":
+            outcomes = self._analyze_devices_single_session(url, devices, wait_time, progress, force, stream, strict_network)
+        else:
+            # Each pass mostly waits on the browser and Gemini, so run them side by side
+            outcomes = self._for_each_device(devices, lambda device: self._analyze_device(
+                url, device, wait_time, progress, force, stream, strict_network))
+
+        # Merge in device order so findings/errors read the same as a sequential run
+        for device in devices:
+            finding, error = outcomes[device]
+            results["findings"][device] = finding
+            if error:
+                results["errors"].append(error)
+        results["network"] = merge_network_stats(
+            finding["network"] for finding in results["findings"].values() if "network" in finding
+        )
 
-                logging.info(f"Loading URL: {url}")
-                driver.get(url)
-                WebDriverWait(driver, wait_time).until(
-                    EC.presence_of_element_located((By.TAG_NAME, "body"))
+        # Final comprehensive analysis comparing both views (if both successful)
+        if "desktop" in results["findings"] and "mobile" in results["findings"] and \
+           "error" not in results["findings"]["desktop"] and "error" not in results["findings"]["mobile"]:
+            try:
+                # The two device analyses are the prompt's only page-dependent input, so key on them rather than
+                # on the rendered HTML: a reused or cached device analysis then reuses the comprehensive one too
+                cache_key = AuditCache.key(
+                    normalize_url(url), "comprehensive", self._network_mode(strict_network),
+                    results["findings"]["desktop"]["gemini_analysis"],
+                    results["findings"]["mobile"]["gemini_analysis"],
                 )
-                logging.info("Page body located. Waiting for dynamic content.")
-                time.sleep(5)  # Wait for potential JS rendering
+                cached = None if force else self.cache.get(cache_key)
+                if not cached and not force and self.incremental:
+                    # Outlives the cache TTL, so weekly re-audits of a stable page still skip the call
+                    previous = self.history.comprehensive_for(normalize_url(url), cache_key)
+                    cached = {"comprehensive_analysis": previous} if previous else None
+                if cached:
+                    logging.info("Reusing cached comprehensive analysis (device analyses unchanged)")
+                    results["comprehensive_analysis"] = cached["comprehensive_analysis"]
+                    if stream:
+                        self._report_progress(progress, "gemini_chunk", None, {"text": results["comprehensive_analysis"]})
+                else:
+                    logging.info("Generating comprehensive analysis")
+                    self._report_progress(progress, "comprehensive")
+                    with stage_timer("comprehensive", timings=timings):
+                        results["comprehensive_analysis"] = self._generate_comprehensive_analysis(
+                            results["findings"]["desktop"],
+                            results["findings"]["mobile"],
+                            url,
+                            on_chunk=self._chunk_reporter(progress, None) if stream else None
+                        )
+                    logging.info("Comprehensive analysis generated.")
+                    if not results["comprehensive_analysis"].startswith("Error:"):
+                        self.cache.set(cache_key, {"comprehensive_analysis": results["comprehensive_analysis"]})
+                        self.history.record_comprehensive(normalize_url(url), cache_key, results["comprehensive_analysis"])
+            except Exception as e:
+                error_msg = "Error generating comprehensive analysis."
+                logging.error(error_msg + f" Details: {str(e)}")
+                results["errors"].append(error_msg)
+                results["comprehensive_analysis"] = f"Could not generate comprehensive analysis: {e}"
 
-                # 1. Run axe accessibility test
-                logging.info("Injecting Axe core")
-                axe = Axe(driver)
-                axe.inject()
-                logging.info("Running Axe analysis")
-                axe_results = axe.run()
-                logging.info(f"Axe analysis complete. Violations: {len(axe_results.get('violations', []))}")
+        logging.info(f"Analysis finished for {url}. Errors encountered: {len(results['errors'])}")
+        return results
 
+    def _for_each_device(self, devices, fn):
+        """Run fn(device) for every device, up to self.device_concurrency at a time. Returns {device: result}."""
+        workers = min(len(devices), self.device_concurrency)
+        if workers <= 1:
+            return {device: fn(device) for device in devices}
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="audit-device") as executor:
+            futures = {device: executor.submit(fn, device) for device in devices}
+            return {device: future.result() for device, future in futures.items()}
+
+    def _analyze_device(self, url, device, wait_time, progress=None, force=False, stream=False, strict_network=False):
+        """Run one device pass on its own pooled session. Returns (finding, error) and never raises, so passes stay isolated."""
+        logging.info(f"Analyzing {device} version of {url}")
+        timings = {}  # stage -> milliseconds, reported in the finding
+        try:
+            with self.driver_pool.session(device, timings=timings) as driver:
+                capture = self._capture_device(driver, url, device, wait_time, progress, force, timings,
+                                               strict_network=strict_network)
+            # The browser is already back in the pool for the Gemini call
+            return self._finish_device(url, device, capture, progress, timings, stream), None
+        except Exception as e:
+            return self._device_error(device, wait_time, e, timings)
 
-                # 2. Capture screenshot
-                # Setting a reasonable height, full scroll capture can be flaky/slow
+    def _analyze_devices_single_session(self, url, devices, wait_time, progress, force, stream, strict_network=False):
+        """Run every device pass in one browser session, switching profiles through DevTools emulation.
+
+        Browser work is sequential; the Gemini calls for the captured passes
+        then run side by side. Returns {device: (finding, error)}.
+        """
+        timings = {device: {} for device in devices}
+        captures, outcomes = {}, {}
+        try:
+            with self.driver_pool.session(SHARED_SESSION, timings=timings[devices[0]]) as driver:
+                try:
+                    for index, device in enumerate(devices):
+                        logging.info(f"Analyzing {device} version of {url} (single session)")
+                        try:
+                            if index:
+                                # Each pass starts as a first visit, like on its own session; only the HTTP cache carries over
+                                clear_site_data(driver)
+                            with stage_timer("emulation", device, timings[device]):
+                                apply_device_emulation(driver, DEVICE_PROFILES[device])
+                            captures[device] = self._capture_device(driver, url, device, wait_time, progress, force,
+                                                                    timings[device], emulated=True,
+                                                                    strict_network=strict_network)
+                        except Exception as e:
+                            outcomes[device] = self._device_error(device, wait_time, e, timings[device])
+                finally:
+                    clear_device_emulation(driver)
+        except Exception as e:
+            # No usable session: every pass that hasn't finished its browser work fails the same way
+            for device in devices:
+                if device not in captures and device not in outcomes:
+                    outcomes[device] = self._device_error(device, wait_time, e, timings[device])
+
+        def finish(device):
+            try:
+                return self._finish_device(url, device, captures[device], progress, timings[device], stream), None
+            except Exception as e:
+                return self._device_error(device, wait_time, e, timings[device])
+
+        outcomes.update(self._for_each_device(list(captures), finish))
+        return outcomes
+
+    def _capture_device(self, driver, url, device, wait_time, progress, force, timings, emulated=False,
+                        strict_network=False):
+        """Browser half of a device pass: load, Axe, HTML and (unless cached) the screenshot.
+
+        `emulated` means the session is switched to the device through DevTools
+        emulation, so the viewport is resized the same way.
+        """
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+        with startup.timed("import_axe"):
+            from axe_selenium_python import Axe
+
+        profile = DEVICE_PROFILES[device]
+        logging.info(f"Loading URL: {url}")
+        self._report_progress(progress, "loading", device)
+        with stage_timer("page_load", device, timings):
+            install_readiness_probe(driver)
+            self.network.before_load(driver, strict=strict_network)
+            driver.get(url)
+            WebDriverWait(driver, wait_time).until(
+                EC.presence_of_element_located((By.TAG_NAME, "body"))
+            )
+        logging.info("Page body located. Waiting for dynamic content to settle.")
+        with stage_timer("readiness", device, timings):
+            load_readiness = wait_for_page_ready(driver, timeout=self.ready_timeout, quiet_ms=self.ready_quiet_ms)
+        logging.info(f"Page ready after {load_readiness['waited_ms']} ms ({load_readiness['signal']})")
+
+        # 1. Run axe accessibility test
+        logging.info("Injecting Axe core")
+        self._report_progress(progress, "axe", device)
+        with stage_timer("axe", device, timings):
+            axe = Axe(driver)
+            axe.inject()
+            logging.info("Running Axe analysis")
+            axe_results = axe.run()
+        logging.info(f"Axe analysis complete. Violations: {len(axe_results.get('violations', []))}")
+        # Axe results are useful to the user long before Gemini answers
+        self._report_progress(progress, "axe_results", device, {
+            "axe_violations_count": len(axe_results.get("violations", [])),
+            "axe_violations_summary": summarize_violations(axe_results.get("violations", [])[:5]),
+        })
+
+
+        # 2. Get page HTML source
+        logging.info("Getting HTML source")
+        with stage_timer("page_source", device, timings):
+            html_source = driver.page_source
+
+        # Unchanged rendered content means Gemini would see the same input as last time. A strict load
+        # renders a different page (fonts, media), so it never reuses an analysis of a filtered one
+        network_mode = self._network_mode(strict_network)
+        fingerprint = content_fingerprint(html_source, axe_results)
+        cache_key = AuditCache.key(normalize_url(url), device, network_mode, fingerprint)
+        cached = None if force else self.cache.get(cache_key)
+
+        # What changed since this page's last run; with an earlier analysis to build on, Gemini only sees the diff
+        violations = normalize_violations(axe_results.get("violations", []))
+        previous = self.history.last_run(normalize_url(url), device, network_mode=network_mode)
+        diff = diff_violations(previous["violations"], violations) if previous else None
+        incremental = bool(self.incremental and not cached and not force and previous and previous["gemini_analysis"])
+
+        resize_readiness = None
+        screenshot = None
+        if not cached and not incremental:
+            # 3. Capture screenshot (only Gemini needs it)
+            # Setting a reasonable height, full scroll capture can be flaky/slow
+            self._report_progress(progress, "screenshot", device)
+            with stage_timer("screenshot", device, timings):
                 screenshot_height = min(driver.execute_script("return document.body.scrollHeight"), 3000)
-                screenshot_width = 1280 if device == "desktop" else 375 # Width from options or emulation
-                driver.set_window_size(screenshot_width, screenshot_height)
-                time.sleep(1) # Allow resize to settle
+                if emulated:
+                    apply_device_emulation(driver, profile, height=screenshot_height)
+                else:
+                    driver.set_window_size(profile["width"], screenshot_height)
+                # Allow resize to settle; layout only needs a short quiet window
+                resize_readiness = wait_for_page_ready(driver, timeout=2, quiet_ms=150)
 
                 logging.info("Capturing screenshot")
                 screenshot = driver.get_screenshot_as_png()
-                img = Image.open(BytesIO(screenshot))
-
-
-                # 3. Get page HTML source
-                logging.info("Getting HTML source")
-                html_source = driver.page_source
 
+        # Everything the page fetched, including lazy loads triggered by the screenshot resize
+        network = self.network.collect_stats(driver)
+        network["strict"] = network_mode == "strict"
+        REQUESTS_BLOCKED.inc(network["blocked_requests"], device=device)
+        PAGE_BYTES.inc(network["network_bytes"], device=device, source="network")
+        PAGE_BYTES.inc(network["cached_bytes"], device=device, source="cache")
+        logging.info(f"Network for {device}: {network['requests']} requests, {network['blocked_requests']} blocked, "
+                     f"{network['cached_bytes']} bytes from cache, {network['network_bytes']} bytes over the network")
+
+        return {
+            "axe_results": axe_results,
+            "html_source": html_source,
+            "fingerprint": fingerprint,
+            "network_mode": network_mode,
+            "cache_key": cache_key,
+            "cached": cached,
+            "violations": violations,
+            "previous": previous,
+            "diff": diff,
+            "incremental": incremental,
+            "screenshot": screenshot,
+            "readiness": {"load": load_readiness, "resize": resize_readiness},
+            "network": network,
+        }
+
+    def _finish_device(self, url, device, capture, progress, timings, stream=False):
+        """Model half of a device pass: encode the screenshot, ask Gemini (or reuse the cache), build the finding."""
+        profile = DEVICE_PROFILES[device]
+        axe_results = capture["axe_results"]
+        cached = capture["cached"]
+
+        screenshot_stats = None
+        diff = capture["diff"]
+        if cached:
+            logging.info(f"Reusing cached Gemini analysis for {device} (content unchanged)")
+            analysis_mode = "cached"
+            gemini_analysis = cached["gemini_analysis"]
+            if stream:
+                self._report_progress(progress, "gemini_chunk", device, {"text": gemini_analysis})
+        elif capture["incremental"] and not has_changes(diff):
+            # Same violations on the same nodes as last run: the earlier analysis still holds
+            logging.info(f"Reusing previous Gemini analysis for {device} (violations unchanged since run {capture['previous']['run_id']})")
+            analysis_mode = "reused"
+            gemini_analysis = capture["previous"]["gemini_analysis"]
+            if stream:
+                self._report_progress(progress, "gemini_chunk", device, {"text": gemini_analysis})
+            self.cache.set(capture["cache_key"], {"gemini_analysis": gemini_analysis})
+        elif capture["incremental"]:
+            logging.info(f"Starting incremental Gemini analysis for {device} ({len(diff['new'])} new, "
+                         f"{len(diff['fixed'])} fixed, {len(diff['changed'])} changed rules)")
+            analysis_mode = "incremental"
+            self._report_progress(progress, "gemini", device)
+            with stage_timer("gemini", device, timings):
+                gemini_analysis = self._update_analysis_with_gemini(
+                    url=url,
+                    previous_analysis=capture["previous"]["gemini_analysis"],
+                    diff=diff,
+                    device_type=device,
+                    on_chunk=self._chunk_reporter(progress, device) if stream else None
+                )
+            logging.info("Incremental Gemini analysis complete")
+            if not gemini_analysis.startswith("Error:"):
+                self.cache.set(capture["cache_key"], {"gemini_analysis": gemini_analysis})
+        else:
+            analysis_mode = "full"
+            # Downscale and compress before upload instead of handing Gemini a full decoded bitmap
+            with stage_timer("encode_screenshot", device, timings):
+                image_parts, screenshot_stats = encode_screenshot(
+                    capture.pop("screenshot"), viewport=(profile["width"], profile["height"])
+                )
+            logging.info(f"Screenshot encoded: {screenshot_stats['bytes_sent']} bytes in "
+                         f"{screenshot_stats['tiles']} tile(s), {screenshot_stats['encode_ms']} ms")
 
-                # 4. Direct Gemini analysis
-                logging.info("Starting Gemini analysis")
+            # 4. Direct Gemini analysis
+            logging.info("Starting Gemini analysis")
+            self._report_progress(progress, "gemini", device)
+            with stage_timer("gemini", device, timings):
                 gemini_analysis = self._analyze_with_gemini(
                     url=url,
-                    html=html_source,
+                    html=capture["html_source"],
                     axe_results=axe_results,
-                    screenshot=img,
-                    device_type=device
+                    screenshot=image_parts,
+                    device_type=device,
+                    on_chunk=self._chunk_reporter(progress, device) if stream else None
                 )
-                logging.info("Gemini analysis complete")
-
-                # Store results
-                results["findings"][device] = {
-                    "axe_violations_count": len(axe_results.get("violations", [])),
-                    # Storing only key details to keep JSON small, modify if needed
-                    "axe_violations_summary": [
-                         {
-                            "id": v['id'],
-                            "impact": v['impact'],
-                            "help": v['help'],
-                            "nodes": len(v['nodes'])
-                         } for v in axe_results.get("violations", [])[:5] # Top 5 violations
-                    ],
-                    "gemini_analysis": gemini_analysis
-                }
-                logging.info(f"âœ… {device.title()} analysis successful")
-
-            except TimeoutException as e:
-                error_msg = f"Error analyzing {device} version: Page timed out after {wait_time} seconds. The site might be too slow, complex, or inaccessible."
-                logging.error(error_msg + f" Details: {e}")
-                results["findings"][device] = {"error": error_msg}
-                results["errors"].append(f"{device.title()} analysis failed: Page timed out.")
-            except WebDriverException as e:
-                 error_msg = f"Error analyzing {device} version: WebDriver issue. This might be due to browser compatibility or configuration on the server."
-                 logging.error(error_msg + f" Details: {e}")
-                 results["findings"][device] = {"error": error_msg}
-                 results["errors"].append(f"{device.title()} analysis failed: WebDriver error.")
-            except Exception as e:
-                error_msg = f"An unexpected error occurred during {device} analysis."
-                logging.error(error_msg + f" Details: {str(e)}")
-                results["findings"][device] = {"error": error_msg}
-                results["errors"].append(f"{device.title()} analysis failed: {str(e)}")
-            finally:
-                if driver:
-                    logging.info(f"Quitting WebDriver for {device} view.")
-                    driver.quit()
+            logging.info("Gemini analysis complete")
+            if not gemini_analysis.startswith("Error:"):
+                self.cache.set(capture["cache_key"], {"gemini_analysis": gemini_analysis})
+
+        # Store results
+        finding = {
+            "axe_violations_count": len(axe_results.get("violations", [])),
+            # Storing only key details to keep JSON small, modify if needed
+            "axe_violations_summary": summarize_violations(axe_results.get("violations", [])[:5]), # Top 5 violations
+            # Every violation in the same compact form, for site-level roll-ups
+            "axe_violations": summarize_violations(axe_results.get("violations", [])),
+            "gemini_analysis": gemini_analysis,
+            # How long each wait took and which signal ended it
+            "readiness": capture["readiness"],
+            "content_fingerprint": capture["fingerprint"],
+            "cache_hit": bool(cached),
+            # How gemini_analysis was produced: full, incremental (diff only), reused (from the last run) or cached
+            "analysis_mode": analysis_mode,
+            # Rule-level changes since the previous run of this URL and device (None on the first run)
+            "violations_diff": dict(diff, previous_run_id=capture["previous"]["run_id"],
+                                    previous_at=capture["previous"]["created_at"]) if diff else None,
+            "screenshot": screenshot_stats,
+            "network": capture["network"],
+            "timings": timings,
+        }
+        finding["history_run_id"] = self.history.record(
+            normalize_url(url), device, capture["violations"], fingerprint=capture["fingerprint"],
+            gemini_analysis=None if gemini_analysis.startswith("Error:") else gemini_analysis,
+            analysis_mode=analysis_mode, network_mode=capture["network_mode"],
+        )
+        logging.info(f"âœ… {device.title()} analysis successful")
+        return finding
+
+    def _device_error(self, device, wait_time, e, timings):
+        """Map an exception from a device pass to its (finding, error) pair."""
+        if isinstance(e, TimeoutException):
+            error_msg = f"Error analyzing {device} version: Page timed out after {wait_time} seconds. The site might be too slow, complex, or inaccessible."
+            logging.error(error_msg + f" Details: {e}")
+            return {"error": error_msg, "timings": timings}, f"{device.title()} analysis failed: Page timed out."
+        if isinstance(e, WebDriverException):
+             error_msg = f"Error analyzing {device} version: WebDriver issue. This might be due to browser compatibility or configuration on the server."
+             logging.error(error_msg + f" Details: {e}")
+             return {"error": error_msg, "timings": timings}, f"{device.title()} analysis failed: WebDriver error."
+        error_msg = f"An unexpected error occurred during {device} analysis."
+        logging.error(error_msg + f" Details: {str(e)}")
+        return {"error": error_msg, "timings": timings}, f"{device.title()} analysis failed: {str(e)}"
+
+    def _network_mode(self, strict_network=False):
+        """How this pass loads the page: "strict" (nothing blocked) or "filter"."""
+        return "strict" if strict_network or self.network.mode == "strict" else "filter"
+
+    def _report_progress(self, progress, stage, device=None, data=None):
+        """Forward a stage change to the caller's progress hook; a broken hook must not fail the audit."""
+        if not progress:
+            return
+        try:
+            progress(stage, device, data)
+        except Exception as e:
+            logging.warning(f"Progress callback failed for stage {stage} ({device}): {e}")
 
-        # Final comprehensive analysis comparing both views (if both successful)
-        if "desktop" in results["findings"] and "mobile" in results["findings"] and \
-           "error" not in results["findings"]["desktop"] and "error" not in results["findings"]["mobile"]:
-            try:
-                logging.info("Generating comprehensive analysis")
-                results["comprehensive_analysis"] = self._generate_comprehensive_analysis(
-                    results["findings"]["desktop"],
-                    results["findings"]["mobile"],
-                    url
-                )
-                logging.info("Comprehensive analysis generated.")
-            except Exception as e:
-                error_msg = "Error generating comprehensive analysis."
-                logging.error(error_msg + f" Details: {str(e)}")
-                results["errors"].append(error_msg)
-                results["comprehensive_analysis"] = f"Could not generate comprehensive analysis: {e}"
+    def _chunk_reporter(self, progress, device):
+        return lambda text: self._report_progress(progress, "gemini_chunk", device, {"text": text})
 
-        logging.info(f"Analysis finished for {url}. Errors encountered: {len(results['errors'])}")
-        return results
+    def _generate(self, contents, on_chunk=None, call="device"):
+        """Call the model through self.gemini. With `on_chunk`, stream the response and pass each text chunk to it as it arrives.
+
+        Either way the returned response is complete, so callers read .parts
+        and .text exactly as for a non-streamed call.
+        """
+        return self.gemini.generate(contents, on_chunk, call=call)
 
-    def _analyze_with_gemini(self, url, html, axe_results, screenshot, device_type):
-        """Send data directly to Gemini for multimodal analysis - CONCISE version"""
+    def _analyze_with_gemini(self, url, html, axe_results, screenshot, device_type, on_chunk=None):
+        """Send data directly to Gemini for multimodal analysis - CONCISE version
+
+        `screenshot` is the list of encoded image parts from encode_screenshot.
+        """
         logging.info(f"Preparing prompt for Gemini ({device_type})...")
 
         violations = axe_results.get("violations", [])
@@ -224,7 +620,9 @@ class AccessibilityAuditor:
         """
 
         try:
-            response = self.model.generate_content([prompt, screenshot])
+            if len(screenshot) > 1:
+                prompt += f"\n        The screenshot is split into {len(screenshot)} tiles, ordered top to bottom.\n"
+            response = self._generate([prompt, *screenshot], on_chunk)
             logging.info(f"Gemini response received for {device_type}.")
             # Basic check for safety blocking - add more robust checks if needed
             if not response.parts:
@@ -233,16 +631,67 @@ class AccessibilityAuditor:
                  prompt_feedback = getattr(response, 'prompt_feedback', None)
                  if prompt_feedback and prompt_feedback.block_reason:
                      logging.error(f"Gemini content blocked. Reason: {prompt_feedback.block_reason}")
+                     GEMINI_BLOCKED.inc(call="device")
                      return f"Error: Gemini analysis blocked due to safety settings (Reason: {prompt_feedback.block_reason}). Input might contain sensitive content or violate policies."
+                 GEMINI_ERRORS.inc(call="device")
                  return "Error: Gemini returned an empty response. The analysis could not be performed for this view."
 
             return response.text
         except Exception as e:
             logging.error(f"Gemini API call failed for {device_type}: {e}")
+            GEMINI_ERRORS.inc(call="device")
+            return f"Error: Failed to get analysis from Gemini API. ({e})"
+
+
+    def _update_analysis_with_gemini(self, url, previous_analysis, diff, device_type, on_chunk=None):
+        """Revise the previous run's analysis for what changed since, instead of analyzing the page from scratch."""
+        logging.info(f"Preparing incremental prompt for Gemini ({device_type})...")
+
+        def rules(items, describe):
+            return "\n".join(f"- {v['id']} ({v['impact']}): {describe(v)}" for v in items) or "- None"
+
+        prompt = f"""
+        Below is your earlier accessibility analysis of the {device_type} view of {url}, followed by what Axe found changed since then. Update the analysis to reflect the current state, keeping the same format and focus (critical barriers, WCAG 2.1 AA / EN 301 549 references, strong and direct language).
+
+        Earlier analysis:
+        {previous_analysis}
+
+        New violations:
+        {rules(diff["new"], lambda v: f"{v['help']} ({v['nodes']} instances)")}
+
+        Fixed violations:
+        {rules(diff["fixed"], lambda v: f"{v['help']} (was {v['nodes']} instances)")}
+
+        Violations on a different set of elements:
+        {rules(diff["changed"], lambda v: f"{v['help']} ({v['nodes_before']} -> {v['nodes_after']} instances)")}
+
+        Instructions:
+        1.  Remove or soften barriers that the fixed violations resolve.
+        2.  Add any new barrier that is severe enough to belong in the **max 3-5** most severe.
+        3.  Keep everything else from the earlier analysis unchanged.
+        4.  Output only the updated analysis: one-sentence overall assessment, then bullet points.
+        """
+
+        try:
+            response = self._generate(prompt, on_chunk)
+            logging.info(f"Incremental Gemini response received for {device_type}.")
+            if not response.parts:
+                 logging.warning(f"Incremental Gemini response for {device_type} might be empty or blocked.")
+                 prompt_feedback = getattr(response, 'prompt_feedback', None)
+                 if prompt_feedback and prompt_feedback.block_reason:
+                     logging.error(f"Gemini content blocked. Reason: {prompt_feedback.block_reason}")
+                     GEMINI_BLOCKED.inc(call="device")
+                     return f"Error: Gemini analysis blocked due to safety settings (Reason: {prompt_feedback.block_reason})."
+                 GEMINI_ERRORS.inc(call="device")
+                 return "Error: Gemini returned an empty response. The analysis could not be updated for this view."
+            return response.text
+        except Exception as e:
+            logging.error(f"Incremental Gemini API call failed for {device_type}: {e}")
+            GEMINI_ERRORS.inc(call="device")
             return f"Error: Failed to get analysis from Gemini API. ({e})"
 
 
-    def _generate_comprehensive_analysis(self, desktop_results, mobile_results, url):
+    def _generate_comprehensive_analysis(self, desktop_results, mobile_results, url, on_chunk=None):
         """Generate comprehensive analysis comparing desktop and mobile findings - CONCISE version"""
         logging.info("Preparing comprehensive analysis prompt...")
 
@@ -269,7 +718,7 @@ class AccessibilityAuditor:
         """
 
         try:
-            response = self.model.generate_content(prompt)
+            response = self._generate(prompt, on_chunk, call="comprehensive")
             logging.info("Comprehensive analysis received from Gemini.")
              # Basic check for safety blocking
             if not response.parts:
@@ -277,10 +726,13 @@ class AccessibilityAuditor:
                  prompt_feedback = getattr(response, 'prompt_feedback', None)
                  if prompt_feedback and prompt_feedback.block_reason:
                      logging.error(f"Comprehensive Gemini content blocked. Reason: {prompt_feedback.block_reason}")
+                     GEMINI_BLOCKED.inc(call="comprehensive")
                      return f"Error: Comprehensive analysis blocked due to safety settings (Reason: {prompt_feedback.block_reason})."
+                 GEMINI_ERRORS.inc(call="comprehensive")
                  return "Error: Gemini returned an empty response for the comprehensive analysis."
             return response.text
         except Exception as e:
             logging.error(f"Comprehensive Gemini API call failed: {e}")
+            GEMINI_ERRORS.inc(call="comprehensive")
             return f"Error: Failed to generate comprehensive analysis via Gemini API. ({e})"
 